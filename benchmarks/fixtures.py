@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+"""Respuestas del ministerio para los benchmarks, en cuatro escalas: municipio, provincia, ccaa y nacion.
+
+Por defecto se generan de forma determinista (misma semilla, mismos datos) con el formato de los servicios REST
+reales. Con `grabar` se descargan las respuestas reales y se guardan en un directorio para reproducirlas despues
+con `cargar`, de forma que distintas ejecuciones comparen siempre los mismos datos.
+"""
+import gzip
+import json
+import random
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import sopabarata.static as st
+
+ESCALAS = 'municipio', 'provincia', 'ccaa', 'nacion'
+
+_CCAA = ['Andalucía', 'Aragón', 'Asturias', 'Balears (Illes)', 'Canarias', 'Cantabria', 'Castilla y León',
+         'Castilla - La Mancha', 'Cataluña', 'Comunitat Valenciana', 'Extremadura', 'Galicia', 'Madrid', 'Murcia',
+         'Navarra', 'País Vasco', 'Rioja (La)', 'Ceuta', 'Melilla']
+_PRODUCTOS = [(1, 'Gasolina 95 E5', 'G95E5'), (3, 'Gasolina 98 E5', 'G98E5'), (4, 'Gasóleo A habitual', 'GOA'),
+              (5, 'Gasóleo Premium', 'GOA+'), (6, 'Gasóleo B', 'GOB'), (8, 'Biodiésel', 'BIE'),
+              (16, 'Bioetanol', 'BIO'), (17, 'Gas natural comprimido', 'GNC'), (18, 'Gas natural licuado', 'GNL'),
+              (19, 'Gases licuados del petróleo', 'GLP'), (20, 'Gasolina 95 E5 Premium', 'G95E5+'),
+              (21, 'Gasolina 98 E10', 'G98E10'), (23, 'Gasolina 95 E10', 'G95E10')]
+_PRECIOS = ['Precio Biodiesel', 'Precio Bioetanol', 'Precio Gas Natural Comprimido', 'Precio Gas Natural Licuado',
+            'Precio Gases licuados del petróleo', 'Precio Gasoleo A', 'Precio Gasoleo B', 'Precio Gasoleo Premium',
+            'Precio Gasolina 95 E10', 'Precio Gasolina 95 E5', 'Precio Gasolina 95 E5 Premium',
+            'Precio Gasolina 98 E10', 'Precio Gasolina 98 E5', 'Precio Hidrogeno']
+_ROTULOS = ['REPSOL', 'CEPSA', 'BP', 'GALP', 'SHELL', 'PLENOIL', 'BALLENOIL', 'PETROPRIX']
+
+# rutas de los servicios de filtrado que se responden con cada escala (relativas a REST_ESTACION)
+RUTAS = {'municipio': 'Municipio/0001', 'provincia': 'Provincia/01', 'ccaa': 'CCAA/01'}
+
+
+def _decimal(valor: float, decimales: int) -> str:
+    return f'{valor:.{decimales}f}'.replace('.', ',')
+
+
+def generar(estaciones: int = 12000, municipios: int = 8000, semilla: int = 1) -> Dict[str, object]:
+    """Genera los listados de referencia y las respuestas de estaciones de las cuatro escalas.
+
+    El municipio 1 (provincia 1, CCAA 1) concentra mas estaciones que el resto para que cada escala tenga un tamaño
+    parecido al real: ~20 estaciones el municipio, ~600 la provincia, ~1.100 la comunidad y `estaciones` la nacion.
+
+    :param estaciones: numero de estaciones del listado nacional.
+    :param municipios: numero de municipios del listado de referencia.
+    :param semilla: semilla del generador aleatorio.
+    :return: diccionario con "municipios", "productos" y una respuesta por escala.
+    """
+    aleatorio = random.Random(semilla)
+    provincias = [(p, f'PROVINCIA {p}', (p - 1) % len(_CCAA) + 1) for p in range(1, 53)]
+    lista_municipios = list()
+    for i in range(1, municipios + 1):
+        codigo, provincia, ccaa = provincias[(i - 1) % len(provincias)]
+        lista_municipios.append({'IDMunicipio': str(i), 'IDProvincia': f'{codigo:02d}', 'IDCCAA': f'{ccaa:02d}',
+                                 'Municipio': f'Municipio {i}', 'Provincia': provincia, 'CCAA': _CCAA[ccaa - 1]})
+    productos = [{'IDProducto': str(c), 'NombreProducto': n, 'NombreProductoAbreviatura': a} for c, n, a in _PRODUCTOS]
+
+    filas = list()
+    for i in range(estaciones):
+        # 1 de cada 600 en el municipio 1, 1 de cada 30 en otros municipios de su provincia, resto al azar
+        sorteo = aleatorio.random()
+        if sorteo < 1 / 600:
+            m = lista_municipios[0]
+        elif sorteo < 1 / 30:
+            m = lista_municipios[52 * aleatorio.randrange(1, municipios // 52)]
+        else:
+            m = aleatorio.choice(lista_municipios)
+        fila = {'C.P.': f'{aleatorio.randint(1000, 52999):05d}', 'Dirección': f'CALLE {i}', 'Horario': 'L-D: 24H',
+                'Latitud': _decimal(aleatorio.uniform(36, 43.5), 6), 'Localidad': m['Municipio'].upper(),
+                'Longitud (WGS84)': _decimal(aleatorio.uniform(-9, 3.3), 6), 'Margen': 'D',
+                'Municipio': m['Municipio'], 'Provincia': m['Provincia'], 'Remisión': 'dm',
+                'Rótulo': aleatorio.choice(_ROTULOS), 'Tipo Venta': 'P', '% BioEtanol': '0,0',
+                '% Éster metílico': '0,0', 'IDEESS': str(1000 + i), 'IDMunicipio': m['IDMunicipio'],
+                'IDProvincia': m['IDProvincia'], 'IDCCAA': m['IDCCAA']}
+        for campo in _PRECIOS:
+            fila[campo] = _decimal(aleatorio.uniform(1.3, 1.9), 3) if aleatorio.random() < 0.6 else ''
+        filas.append(fila)
+
+    def respuesta(lista: List[Dict]) -> Dict:
+        return {'Fecha': '18/10/2026 10:00:00', 'ListaEESSPrecio': lista, 'Nota': '', 'ResultadoConsulta': 'OK'}
+
+    return {'municipios': lista_municipios, 'productos': productos,
+            'municipio': respuesta([f for f in filas if f['IDMunicipio'] == '1']),
+            'provincia': respuesta([f for f in filas if f['IDProvincia'] == '01']),
+            'ccaa': respuesta([f for f in filas if f['IDCCAA'] == '01']),
+            'nacion': respuesta(filas)}
+
+
+def grabar(directorio: str, obtener: Callable[[str], bytes]) -> Path:
+    """Descarga las respuestas reales del ministerio y las guarda comprimidas para reproducirlas despues.
+
+    :param directorio: carpeta donde se guardan las respuestas.
+    :param obtener: funcion que descarga una URL y devuelve el cuerpo de la respuesta.
+    :return: carpeta de las respuestas.
+    """
+    urls = {'municipios': f'{st.REST_LISTADO}/Municipios/', 'productos': f'{st.REST_LISTADO}/ProductosPetroliferos/',
+            'nacion': st.REST_ESTACIONES}
+    urls.update({escala: f'{st.REST_ESTACION}{ruta}' for escala, ruta in RUTAS.items()})
+    directorio = Path(directorio)
+    directorio.mkdir(parents=True, exist_ok=True)
+    for nombre, url in urls.items():
+        (directorio / f'{nombre}.json.gz').write_bytes(gzip.compress(obtener(url)))
+    return directorio
+
+
+def cargar(directorio: str) -> Dict[str, object]:
+    """Carga respuestas grabadas con `grabar`.
+
+    :param directorio: carpeta de las respuestas.
+    :return: mismo formato que `generar`.
+    """
+    directorio = Path(directorio)
+    return {nombre: json.loads(gzip.decompress((directorio / f'{nombre}.json.gz').read_bytes()).decode('utf-8-sig'))
+            for nombre in ('municipios', 'productos', *ESCALAS)}
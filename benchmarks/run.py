@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""Benchmarks de las etapas de consulta de sopabarata sobre un servidor local que sustituye a BASE_URL.
+
+Para cada escala (municipio, provincia, ccaa y nacion) mide descarga y decodificacion (`_consulta`),
+decodificacion, `to_num`, construccion de `EESS` y `Estacion`, `buscar_por_nombre` y
+`gestion_resultados_estaciones`. De cada etapa informa del rendimiento (filas/s), los percentiles de latencia y
+el pico de memoria (tracemalloc, medido en una ejecucion aparte para no falsear los tiempos), y guarda los
+resultados en JSON para compararlos entre ejecuciones:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --repeticiones 20 --escalas municipio provincia
+    python benchmarks/run.py --comparar benchmarks/resultados/anterior.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+
+import fixtures  # noqa: E402
+import sopabarata.static as st  # noqa: E402
+from servidor import ServidorFijo  # noqa: E402
+from sopabarata.core import InfoCombustible  # noqa: E402
+from sopabarata.estadisticas import percentil  # noqa: E402
+from sopabarata.model import EESS, Estacion, Municipio  # noqa: E402
+from sopabarata.utils import decodificar, to_num  # noqa: E402
+
+
+def apuntar(base_url: str):
+    """Redirige las URL de los servicios REST al servidor indicado."""
+    st.BASE_URL = base_url
+    st.REST_ESTACION = f'{base_url}/EstacionesTerrestres/Filtro'
+    st.REST_LISTADO = f'{base_url}/Listados'
+    st.REST_ESTACIONES = f'{base_url}/EstacionesTerrestres/'
+
+
+def medir(funcion: Callable[[], object], filas: int, repeticiones: int) -> Dict[str, float]:
+    """Ejecuta una etapa `repeticiones` veces (tras una de calentamiento) y resume tiempos y memoria.
+
+    :param funcion: etapa a medir.
+    :param filas: filas procesadas por ejecucion, para calcular el rendimiento.
+    :param repeticiones: numero de ejecuciones cronometradas.
+    :return: diccionario con filas, rendimiento, latencias en ms y pico de memoria en KiB.
+    """
+    funcion()
+    tiempos = list()
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tiempos.sort()
+    mediana = statistics.median(tiempos)
+    return dict(filas=filas, filas_s=round(filas / mediana, 1) if mediana else None,
+                p50_ms=round(mediana * 1000, 3), p90_ms=round(percentil(tiempos, 0.9) * 1000, 3),
+                p99_ms=round(percentil(tiempos, 0.99) * 1000, 3), max_ms=round(tiempos[-1] * 1000, 3),
+                pico_kib=round(pico / 1024, 1))
+
+
+def etapas(servidor: ServidorFijo, escala: str) -> Dict[str, Callable[[], object]]:
+    """Etapas a medir para una escala."""
+    url = st.REST_ESTACIONES if escala == 'nacion' else f'{st.REST_ESTACION}{fixtures.RUTAS[escala]}'
+    cuerpo = servidor.cuerpo(url)
+    crudo = json.loads(cuerpo.decode('utf-8-sig'))['ListaEESSPrecio']
+    decodificado = decodificar(cuerpo)
+    filas = decodificado['ListaEESSPrecio']
+    nombres = [f['Municipio'] for f in filas]
+    return {
+        'consulta': lambda: InfoCombustible._consulta(url),
+        'decodificar': lambda: decodificar(cuerpo),
+        'to_num': lambda: to_num(crudo),
+        'eess': lambda: [EESS(**f) for f in filas],
+        'estacion': lambda: [Estacion(**f) for f in filas],
+        'buscar_por_nombre': lambda: [InfoCombustible.buscar_por_nombre(n) for n in nombres],
+        'gestion_resultados_estaciones': lambda: InfoCombustible.gestion_resultados_estaciones(decodificado, Municipio),
+    }
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(resultados: Dict, anterior: Dict):
+    """Muestra la variacion de la mediana de cada etapa respecto a una ejecucion anterior."""
+    print(f'\nComparacion con {anterior.get("fecha")} ({anterior.get("commit")}): p50 actual / anterior')
+    for escala, por_etapa in resultados['escalas'].items():
+        for etapa, medida in por_etapa.items():
+            previa = anterior.get('escalas', dict()).get(escala, dict()).get(etapa)
+            if previa and previa.get('p50_ms'):
+                print(f'  {escala:<10} {etapa:<30} {medida["p50_ms"] / previa["p50_ms"]:6.2f}x')
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Benchmarks de sopabarata.')
+    parser.add_argument('--escalas', nargs='+', choices=fixtures.ESCALAS, default=list(fixtures.ESCALAS))
+    parser.add_argument('--etapas', nargs='+', help='Solo las etapas indicadas.')
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--fixtures', metavar='DIR', help='Respuestas grabadas con --grabar (por defecto sinteticas).')
+    parser.add_argument('--grabar', metavar='DIR', help='Graba las respuestas reales del ministerio y termina.')
+    parser.add_argument('--salida', metavar='FICHERO', help='Fichero JSON de resultados '
+                                                            '(por defecto benchmarks/resultados/<fecha>.json).')
+    parser.add_argument('--comparar', metavar='FICHERO', help='Resultados anteriores con los que comparar.')
+    args = parser.parse_args()
+
+    if args.grabar:
+        print(fixtures.grabar(args.grabar, lambda url: InfoCombustible.cliente.get(url).content))
+        return
+
+    datos = fixtures.cargar(args.fixtures) if args.fixtures else fixtures.generar()
+    servidor = ServidorFijo(datos).arrancar()
+    apuntar(servidor.base_url)
+    InfoCombustible.cache = None
+    InfoCombustible.modo_snapshot = False
+    InfoCombustible.get_productos()
+    InfoCombustible.get_municipios()
+
+    resultados = dict(fecha=datetime.now().isoformat(timespec='seconds'), commit=commit(),
+                      python=platform.python_version(), plataforma=platform.platform(),
+                      fixtures=args.fixtures or 'sinteticas', repeticiones=args.repeticiones, escalas=dict())
+    print(f'{"escala":<10} {"etapa":<30} {"filas":>6} {"filas/s":>11} {"p50 ms":>9} {"p90 ms":>9} '
+          f'{"p99 ms":>9} {"pico KiB":>10}')
+    for escala in args.escalas:
+        filas = len(datos[escala]['ListaEESSPrecio'])
+        resultados['escalas'][escala] = dict()
+        for etapa, funcion in etapas(servidor, escala).items():
+            if args.etapas and etapa not in args.etapas:
+                continue
+            medida = medir(funcion, filas, args.repeticiones)
+            resultados['escalas'][escala][etapa] = medida
+            print(f'{escala:<10} {etapa:<30} {filas:>6} {medida["filas_s"] or 0:>11,.0f} {medida["p50_ms"]:>9.2f} '
+                  f'{medida["p90_ms"]:>9.2f} {medida["p99_ms"]:>9.2f} {medida["pico_kib"]:>10,.1f}')
+    servidor.shutdown()
+
+    salida = Path(args.salida or RAIZ / 'benchmarks' / 'resultados' / f'{datetime.now():%Y%m%d-%H%M%S}.json')
+    salida.parent.mkdir(parents=True, exist_ok=True)
+    salida.write_text(json.dumps(resultados, indent=2, ensure_ascii=False), encoding='utf-8')
+    print(f'\nResultados guardados en {salida}')
+
+    if args.comparar:
+        comparar(resultados, json.loads(Path(args.comparar).read_text(encoding='utf-8')))
+
+
+if __name__ == '__main__':
+    run()
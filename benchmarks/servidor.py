@@ -0,0 +1,63 @@
+# -*- coding:utf-8 -*-
+"""Servidor HTTP local que sustituye a BASE_URL durante los benchmarks respondiendo con las respuestas fijas."""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+from fixtures import RUTAS
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    server: 'ServidorFijo'
+
+    def do_GET(self):
+        cuerpo = self.server.cuerpo(self.path)
+        if cuerpo is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+class ServidorFijo(ThreadingHTTPServer):
+    """Responde las rutas de Listados y EstacionesTerrestres con las respuestas ya serializadas."""
+
+    daemon_threads = True
+
+    def __init__(self, datos: Dict[str, object], puerto: int = 0):
+        """Constructor.
+
+        :param datos: respuestas de `fixtures.generar` o `fixtures.cargar`.
+        :param puerto: puerto de escucha, 0 para uno libre.
+        """
+        super().__init__(('127.0.0.1', puerto), _Manejador)
+        # las respuestas se serializan una sola vez, como bytes (con BOM, igual que el servicio real)
+        self._cuerpos = {nombre: b'\xef\xbb\xbf' + json.dumps(valor, ensure_ascii=False).encode('utf-8')
+                         for nombre, valor in datos.items()}
+        self._rutas = {f'/EstacionesTerrestres/Filtro{ruta}': escala for escala, ruta in RUTAS.items()}
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/ServiciosRESTCarburantes/PreciosCarburantes'
+
+    def cuerpo(self, ruta: str):
+        ruta = ruta.split('?')[0].split('/PreciosCarburantes', 1)[-1]
+        if ruta.startswith('/Listados/Municipios'):
+            return self._cuerpos['municipios']
+        if ruta.startswith('/Listados/ProductosPetroliferos'):
+            return self._cuerpos['productos']
+        if ruta.rstrip('/') == '/EstacionesTerrestres':
+            return self._cuerpos['nacion']
+        escala = self._rutas.get(ruta.rstrip('/'))
+        return None if escala is None else self._cuerpos[escala]
+
+    def arrancar(self) -> 'ServidorFijo':
+        threading.Thread(target=self.serve_forever, name='benchmarks-servidor', daemon=True).start()
+        return self
@@ -1,4 +1,4 @@
 # -*- coding:utf-8 -*-
-from sopabarata.core import CCAA, EESS, InfoCombustible, Municipio, Producto, Provincia
+from sopabarata.core import CCAA, EESS, Estacion, InfoCombustible, Municipio, Producto, Provincia, Zona
 
-__all__ = ['InfoCombustible', 'Municipio', 'Provincia', 'CCAA', 'Producto', 'EESS']
+__all__ = ['InfoCombustible', 'Municipio', 'Provincia', 'CCAA', 'Producto', 'EESS', 'Estacion', 'Zona']
@@ -0,0 +1,166 @@
+# -*- coding:utf-8 -*-
+import heapq
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Set, Tuple, Union as U
+
+# puntuaciones de las coincidencias por prefijo, las coincidencias aproximadas puntuan su similitud (0 a 1)
+EXACTA = 1.0
+PREFIJO = 0.9
+PREFIJO_PALABRA = 0.8
+
+
+class Coincidencia(NamedTuple):
+    """Resultado de una busqueda aproximada."""
+
+    objeto: Any
+    tipo: str
+    puntuacion: float
+
+
+def trigramas(clave: str) -> Set[str]:
+    """Trigramas de una clave, con relleno para que los inicios de palabra pesen mas.
+
+    >>> sorted(trigramas('sol'))
+    ['  s', ' so', 'ol ', 'sol']
+
+    :param clave: texto ya normalizado.
+    :return: conjunto de trigramas.
+    """
+    texto = f'  {clave} '
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceDifuso:
+    """Indice de prefijos y trigramas para busquedas tolerantes a erratas y sugerencias mientras se escribe.
+
+    Los prefijos se resuelven con busqueda binaria sobre una lista ordenada de claves (una por cada inicio de
+    palabra, asi "sebas" encuentra "San Sebastian") y las coincidencias aproximadas con listas invertidas de
+    trigramas, por lo que ninguna consulta recorre todos los nombres.
+    """
+
+    def __init__(self, normalizar: Callable[[str], str] = str.casefold):
+        """Constructor.
+
+        :param normalizar: funcion que convierte un nombre en su clave de busqueda (ej: sin acentos ni
+                           mayusculas); se aplica tanto a los nombres indexados como a las consultas.
+        """
+        self.normalizar = normalizar
+        self._entradas: List[Tuple[str, Any, str]] = list()
+        self._prefijos: List[Tuple[str, int]] = list()
+        self._ordenado = True
+        self._trigramas: Dict[str, List[int]] = dict()
+        self._grupos: List[frozenset] = list()
+        # nombres de cada objeto; el maximo limita los candidatos necesarios para obtener n objetos distintos
+        self._nombres: Dict[int, int] = dict()
+        self._max_nombres = 1
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def anadir(self, nombre: str, objeto: Any, tipo: str = None):
+        """Añade un nombre al indice.
+
+        :param nombre: nombre buscable (un mismo objeto puede añadirse con varios nombres).
+        :param objeto: objeto devuelto en las coincidencias.
+        :param tipo: tipo del objeto en los resultados, por defecto el nombre de su clase.
+        """
+        clave = self.normalizar(str(nombre))
+        if not clave:
+            return
+        i = len(self._entradas)
+        self._entradas.append((clave, objeto, tipo or type(objeto).__name__))
+        self._nombres[id(objeto)] = self._nombres.get(id(objeto), 0) + 1
+        self._max_nombres = max(self._max_nombres, self._nombres[id(objeto)])
+        for inicio in [0] + [n + 1 for n, c in enumerate(clave) if c == ' ']:
+            if inicio < len(clave):
+                self._prefijos.append((clave[inicio:], i))
+        self._ordenado = False
+        grupos = frozenset(trigramas(clave))
+        for grupo in grupos:
+            self._trigramas.setdefault(grupo, list()).append(i)
+        self._grupos.append(grupos)
+
+    def preparar(self):
+        """Ordena los prefijos añadidos (si no, se hace en la primera busqueda)."""
+        if not self._ordenado:
+            self._prefijos.sort()
+            self._ordenado = True
+
+    def _por_prefijo(self, clave: str, puntos: Dict[int, float]):
+        self.preparar()
+        for j in range(bisect_left(self._prefijos, (clave,)), len(self._prefijos)):
+            sufijo, i = self._prefijos[j]
+            if not sufijo.startswith(clave):
+                break
+            entrada = self._entradas[i][0]
+            puntos[i] = max(puntos.get(i, 0.0), EXACTA if entrada == clave else
+                            PREFIJO if entrada.startswith(clave) else PREFIJO_PALABRA)
+
+    def _por_trigramas(self, clave: str, puntos: Dict[int, float], minimo: float):
+        grupos = trigramas(clave)
+        listas = sorted((self._trigramas[g] for g in grupos if g in self._trigramas), key=len)
+        # los candidatos salen de los trigramas poco frecuentes; los muy frecuentes (ej: "de ") solo se usan si la
+        # consulta no tiene otros, ya que recorrer sus listas costaria casi tanto como recorrer todos los nombres
+        limite = max(64, len(self._entradas) // 20)
+        raras = [lista for lista in listas if len(lista) <= limite] or listas
+        candidatos = set()
+        for lista in raras:
+            candidatos.update(lista)
+        for i in candidatos:
+            # coeficiente de Dice entre los trigramas de la consulta y los del nombre
+            similitud = 2 * len(grupos & self._grupos[i]) / (len(grupos) + len(self._grupos[i]))
+            if similitud >= minimo and similitud > puntos.get(i, 0.0):
+                puntos[i] = similitud
+
+    def buscar(self, texto: str, n: int = 10, tipos: Iterable[U[type, str]] = None,
+               minimo: float = 0.3) -> List[Coincidencia]:
+        """Nombres que empiezan por el texto (o alguna de sus palabras) o se le parecen, de mejor a peor.
+
+        Las coincidencias exactas y por prefijo puntuan por encima de las aproximadas; a igual puntuacion se
+        prefieren los nombres mas cortos. Cada objeto aparece una sola vez, con su mejor puntuacion.
+
+        >>> indice = IndiceDifuso()
+        >>> for nombre in ['Mora', 'Moral', 'Mura', 'Valle de Mora', 'Madrid']:
+        ...     indice.anadir(nombre, nombre, 'Municipio')
+        >>> indice.anadir('Madrid', 'Comunidad de Madrid', 'CCAA')
+        >>> san_sebastian = 'San Sebastian'
+        >>> indice.anadir(san_sebastian, san_sebastian, 'Municipio')
+        >>> indice.anadir('Donostia San Sebastian', san_sebastian, 'Municipio')
+        >>> [(c.objeto, c.puntuacion) for c in indice.buscar('mora')]
+        [('Mora', 1.0), ('Moral', 0.9), ('Valle de Mora', 0.8), ('Mura', 0.4)]
+        >>> [(c.objeto, c.puntuacion) for c in indice.buscar('sebas')]
+        [('San Sebastian', 0.8)]
+        >>> [(c.objeto, c.tipo) for c in indice.buscar('madird')]
+        [('Madrid', 'Municipio'), ('Comunidad de Madrid', 'CCAA')]
+        >>> [c.objeto for c in indice.buscar('madrid', tipos=['CCAA'])]
+        ['Comunidad de Madrid']
+
+        :param texto: texto buscado (puede estar incompleto o tener erratas).
+        :param n: numero maximo de resultados.
+        :param tipos: tipos de objeto admitidos (clases o nombres de clase, ej: "Municipio"), todos si no se indican.
+        :param minimo: similitud minima (0 a 1) de las coincidencias aproximadas.
+        :return: coincidencias ordenadas por puntuacion.
+        """
+        clave = self.normalizar(str(texto))
+        if not clave:
+            return list()
+        puntos: Dict[int, float] = dict()
+        self._por_prefijo(clave, puntos)
+        # con suficientes nombres que empiezan por el texto no hacen falta coincidencias aproximadas
+        if tipos is not None or sum(p >= PREFIJO for p in puntos.values()) < n * self._max_nombres:
+            self._por_trigramas(clave, puntos, minimo)
+
+        if tipos is not None:
+            tipos = {t if isinstance(t, str) else t.__name__ for t in tipos}
+        candidatos = ((-p, len(self._entradas[i][0]), i) for i, p in puntos.items()
+                      if tipos is None or self._entradas[i][2] in tipos)
+        mejores = heapq.nsmallest(n * self._max_nombres, candidatos)
+        resultado, vistos = list(), set()
+        for p, _, i in mejores:
+            _, objeto, tipo = self._entradas[i]
+            if id(objeto) not in vistos:
+                vistos.add(id(objeto))
+                resultado.append(Coincidencia(objeto, tipo, round(-p, 3)))
+                if len(resultado) == n:
+                    break
+        return resultado
@@ -0,0 +1,105 @@
+# -*- coding:utf-8 -*-
+import gzip
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional as Opt, Tuple
+
+DIRECTORIO = os.environ.get('SOPABARATA_CACHE_DIR', str(Path('~', '.cache', 'sopabarata').expanduser()))
+TTL = int(os.environ.get('SOPABARATA_CACHE_TTL', 24 * 60 * 60))
+
+
+class CacheListados:
+    """Cache en disco para los datos de referencia (Listados) del ministerio.
+
+    Cada listado se guarda comprimido con gzip junto a la fecha de descarga y las cabeceras ETag/Last-Modified
+    recibidas para poder revalidarlo cuando caduque.
+    """
+
+    def __init__(self, directorio: str = None, ttl: int = None):
+        """Constructor.
+
+        :param directorio: carpeta donde se guardan los listados (SOPABARATA_CACHE_DIR o ~/.cache/sopabarata).
+        :param ttl: segundos durante los que un listado se considera vigente (SOPABARATA_CACHE_TTL o 24 horas).
+        """
+        self.directorio = Path(directorio or DIRECTORIO)
+        self.ttl = TTL if ttl is None else int(ttl)
+
+    def ruta(self, nombre: str) -> Path:
+        """Ruta del fichero de cache asociado al listado.
+
+        >>> CacheListados('/tmp').ruta('/Municipios/').name
+        'municipios.json.gz'
+
+        :param nombre: nombre o ruta REST del listado.
+        :return: ruta del fichero de cache.
+        """
+        nombre = '_'.join(p for p in nombre.lower().split('/') if p)
+        return self.directorio / f'{nombre}.json.gz'
+
+    def leer(self, nombre: str) -> Tuple[Opt[Any], Dict]:
+        """Carga un listado de la cache.
+
+        :param nombre: nombre o ruta REST del listado.
+        :return: tupla (datos, metadatos), (None, {}) si no existe o no se puede leer.
+        """
+        try:
+            with gzip.open(self.ruta(nombre), 'rt', encoding='utf-8') as fichero:
+                contenido = json.load(fichero)
+            return contenido.pop('datos'), contenido
+        except (OSError, ValueError, KeyError):
+            return None, dict()
+
+    def guardar(self, nombre: str, datos: Any, etag: str = None, modificado: str = None):
+        """Guarda un listado en la cache de forma atomica.
+
+        :param nombre: nombre o ruta REST del listado.
+        :param datos: datos del listado.
+        :param etag: cabecera ETag de la respuesta.
+        :param modificado: cabecera Last-Modified de la respuesta.
+        """
+        ruta = self.ruta(nombre)
+        temporal = ruta.with_suffix(f'.{os.getpid()}.tmp')
+        try:
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            contenido = dict(guardado=time.time(), etag=etag, modificado=modificado, datos=datos)
+            with gzip.open(temporal, 'wt', encoding='utf-8', compresslevel=6) as fichero:
+                json.dump(contenido, fichero, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temporal, ruta)
+        except OSError:
+            temporal.unlink(missing_ok=True)
+
+    def renovar(self, nombre: str, datos: Any, meta: Dict):
+        """Marca como vigente un listado revalidado por el servidor (respuesta 304).
+
+        :param nombre: nombre o ruta REST del listado.
+        :param datos: datos del listado guardado.
+        :param meta: metadatos devueltos por `leer`.
+        """
+        self.guardar(nombre, datos, meta.get('etag'), meta.get('modificado'))
+
+    def vigente(self, meta: Dict) -> bool:
+        """Comprueba si un listado guardado sigue dentro de su TTL.
+
+        :param meta: metadatos devueltos por `leer`.
+        :return: True si el listado no ha caducado.
+        """
+        return time.time() - meta.get('guardado', 0) < self.ttl
+
+    @staticmethod
+    def cabeceras_validacion(meta: Dict) -> Dict[str, str]:
+        """Cabeceras para una peticion condicional a partir de los metadatos guardados.
+
+        >>> CacheListados.cabeceras_validacion({'etag': '"abc"'})
+        {'If-None-Match': '"abc"'}
+
+        :param meta: metadatos devueltos por `leer`.
+        :return: cabeceras If-None-Match/If-Modified-Since disponibles.
+        """
+        cabeceras = dict()
+        if meta.get('etag'):
+            cabeceras['If-None-Match'] = meta['etag']
+        if meta.get('modificado'):
+            cabeceras['If-Modified-Since'] = meta['modificado']
+        return cabeceras
@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+import random
+import time
+from typing import Any, NamedTuple, Optional as Opt, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from security.safe_requests.api import DEFAULT_PROTOCOLS, UrlParser
+from security.safe_requests.host_validators import DefaultHostValidator
+
+from sopabarata.metricas import metricas
+
+# codigos HTTP que se consideran transitorios y se reintentan
+REINTENTABLES = frozenset({429, 500, 502, 503, 504})
+
+
+class ErrorConsulta(Exception):
+    """Error de una consulta al ministerio tras agotar los reintentos."""
+
+    def __init__(self, url: str, causa: Any):
+        super().__init__(f'{url}: {causa}')
+        self.url = url
+        self.causa = causa
+
+
+class Resultado(NamedTuple):
+    """Resultado de una consulta en bloque.
+
+    >>> Resultado(('Madrid', None), datos=[]).ok, Resultado(('Madrid', None), error='HTTP 503').ok
+    (True, False)
+    """
+
+    consulta: Tuple
+    datos: Any = None
+    error: Opt[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class Cliente:
+    """Cliente HTTP con sesion persistente (keep-alive), timeout y reintentos con espera exponencial."""
+
+    def __init__(self, timeout: float = 30.0, reintentos: int = 3, espera: float = 0.5, conexiones: int = 16):
+        """Constructor.
+
+        :param timeout: segundos maximos de espera por peticion.
+        :param reintentos: reintentos ante errores de red o respuestas 429/5xx.
+        :param espera: espera base en segundos, se duplica en cada reintento.
+        :param conexiones: tamaño del pool de conexiones por host.
+        """
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.espera = espera
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=conexiones, pool_maxsize=conexiones)
+        self.sesion.mount('http://', adaptador)
+        self.sesion.mount('https://', adaptador)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Peticion GET con reintentos.
+
+        :param url: url a consultar.
+        :param kwargs: argumentos adicionales para `requests.Session.get` (headers, stream, ...).
+        Con una sesion que responde 503 y despues 200 se reintenta una vez; si todas las respuestas son 503 se
+        reintenta `reintentos` veces y se lanza `ErrorConsulta`. Los errores no transitorios no se reintentan:
+
+        >>> from types import SimpleNamespace
+        >>> class Sesion:
+        ...     def __init__(self, *estados):
+        ...         self.estados, self.peticiones = list(estados), 0
+        ...     def get(self, url, **kwargs):
+        ...         self.peticiones += 1
+        ...         return SimpleNamespace(status_code=self.estados.pop(0), content=b'{}', close=lambda: None)
+        >>> url = 'https://sedeaplicaciones.minetur.gob.es/Listados'
+        >>> cliente = Cliente(reintentos=2, espera=0)
+        >>> cliente.sesion = Sesion(503, 200)
+        >>> cliente.get(url).status_code, cliente.sesion.peticiones
+        (200, 2)
+        >>> cliente.sesion = Sesion(503, 503, 503)
+        >>> cliente.get(url)
+        Traceback (most recent call last):
+        ...
+        sopabarata.cliente.ErrorConsulta: https://sedeaplicaciones.minetur.gob.es/Listados: HTTP 503
+        >>> cliente.sesion.peticiones
+        3
+        >>> cliente.sesion = Sesion(404)
+        >>> cliente.get(url)
+        Traceback (most recent call last):
+        ...
+        sopabarata.cliente.ErrorConsulta: https://sedeaplicaciones.minetur.gob.es/Listados: HTTP 404
+        >>> cliente.sesion.peticiones
+        1
+
+        :return: la respuesta, puede ser 304 en peticiones condicionales.
+        :raise ErrorConsulta: si la peticion falla tras agotar los reintentos.
+        """
+        UrlParser(url).check(DEFAULT_PROTOCOLS, DefaultHostValidator)
+        kwargs.setdefault('timeout', self.timeout)
+        causa = None
+        for intento in range(self.reintentos + 1):
+            if intento:
+                metricas.contar('http_reintentos')
+                time.sleep(self.espera * 2 ** (intento - 1) * random.uniform(1.0, 1.5))
+            try:
+                with metricas.medir('etapa', etapa='http'):
+                    respuesta = self.sesion.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                metricas.contar('http_peticiones', estado=type(err).__name__)
+                causa = err
+                continue
+            metricas.contar('http_peticiones', estado=respuesta.status_code)
+            if not kwargs.get('stream'):
+                metricas.contar('http_bytes', len(respuesta.content))
+            if respuesta.status_code in REINTENTABLES:
+                causa = f'HTTP {respuesta.status_code}'
+                respuesta.close()
+                continue
+            if respuesta.status_code >= 400:
+                raise ErrorConsulta(url, f'HTTP {respuesta.status_code}')
+            return respuesta
+        raise ErrorConsulta(url, causa)
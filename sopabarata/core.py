@@ -1,11 +1,22 @@
 # -*- coding:utf-8 -*-
+import heapq
 import sys
-from typing import Dict, List, NewType, Optional as Opt, Union as U
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, NewType, Optional as Opt, Tuple, Union as U
 
 import sopabarata.static as st
-from sopabarata.model import CCAA, EESS, Municipio, Producto, Provincia
-from sopabarata.utils import enmendar, normalizar, to_num
-from security import safe_requests
+from sopabarata.busqueda import Coincidencia, IndiceDifuso
+from sopabarata.cache import CacheListados
+from sopabarata.cliente import Cliente, ErrorConsulta, Resultado
+from sopabarata.estadisticas import Estadisticas, Resumen
+from sopabarata.historico import Historico
+from sopabarata.metricas import metricas
+from sopabarata.model import CCAA, EESS, Estacion, Municipio, Producto, Provincia, Zona
+from sopabarata.snapshot import Cambios, Snapshot
+from sopabarata.tabla import TablaPrecios
+from sopabarata.utils import decodificar, enmendar, iterar_lista, normalizar
 
 _MunicipiosList = List[U[Municipio, int]]
 _Productos = List[U[Producto, int]]
@@ -19,32 +30,447 @@ Estaciones = NewType('Estaciones', _Estciones)
 Autonomias = NewType('Autonomias', _CCAA)
 Provincias = NewType('Provincias', _Provincias)
 
+# producto usado para ordenar las estaciones cuando no se filtra por producto (Gasolina 95 E5)
+PRODUCTO = 1
+
 
 # noinspection PyUnresolvedReferences
 class InfoCombustible:
     _municipios: Opt[Municipios] = None
     _productos: Opt[Productos] = None
+    _indice_nombres: Opt[Dict[str, List[U[Municipio, Provincia, CCAA]]]] = None
+    _zonas_por_codigo: Opt[Dict[type, Dict[int, U[Municipio, Provincia, CCAA]]]] = None
+    _provincias_de_ccaa: Opt[Dict[int, List[Provincia]]] = None
+    _municipios_de_provincia: Opt[Dict[int, List[Municipio]]] = None
+    _jerarquia: Opt[Dict[int, Tuple[int, int]]] = None
+    _indice_difuso: Opt[IndiceDifuso] = None
+    # cache en disco de los listados de referencia, None para desactivarla
+    cache: Opt[CacheListados] = CacheListados()
+    # sesion HTTP compartida (keep-alive, timeout y reintentos)
+    cliente: Cliente = Cliente()
+    # modo instantanea: las consultas de estaciones se filtran localmente sobre el listado nacional
+    modo_snapshot: bool = False
+    intervalo_snapshot: int = 30 * 60
+    # segundos de espera tras una descarga fallida de la instantanea antes de volver a intentarla
+    reintento_snapshot: int = 60
+    _snapshot: Opt[Snapshot] = None
+    _ultimo_fallo: float = 0.0
+    # la instantanea la refresca otro hilo (ej: el servidor local), las consultas usan la vigente aunque caduque
+    refresco_en_segundo_plano: bool = False
+    # evitan que varios hilos descarguen a la vez la instantanea o los municipios (ej: consultas en bloque)
+    _bloqueo_snapshot = threading.Lock()
+    _bloqueo_municipios = threading.Lock()
+    # historico de precios, si se asigna cada nueva instantanea se anexa a el
+    historico: Opt[Historico] = None
+    # refresco incremental de la instantanea y funciones suscritas a sus cambios
+    refresco_incremental: bool = True
+    _suscriptores: List[Callable[[Cambios], None]] = list()
+
+    @staticmethod
+    def _clave_nombre(nombre) -> str:
+        """Clave de busqueda usada por el indice de nombres.
+
+        >>> InfoCombustible._clave_nombre(' Rioja (La) ') == InfoCombustible._clave_nombre('la rioja')
+        True
+
+        :param nombre: nombre de municipio, provincia o comunidad autonoma.
+        :return: nombre normalizado, enmendado y en minusculas.
+        """
+        return enmendar(normalizar(str(nombre).strip())).casefold()
+
+    @classmethod
+    def _indexar(cls, municipios: Municipios):
+        """Construye los indices por codigo, jerarquia y nombre a partir de los municipios.
+
+        Jerarquia: CCAA -> Provincia -> Municipio. Las provincias y comunidades son las instancias canonicas
+        compartidas por todos los municipios (ver `Zona.canonica`).
+
+        :param municipios: datos de referencia de todos los municipios.
+        """
+        zonas = {tipo: {z.codigo: z for z in tipo.registradas()} for tipo in (CCAA, Provincia)}
+        zonas[Municipio] = {m.codigo: m for m in municipios}
+        provincias_de_ccaa, municipios_de_provincia = dict(), dict()
+        for p in zonas[Provincia].values():
+            provincias_de_ccaa.setdefault(p.ccaa.codigo, list()).append(p)
+        for m in municipios:
+            municipios_de_provincia.setdefault(m.provincia.codigo, list()).append(m)
+
+        indice = dict()
+        for por_codigo in zonas.values():
+            for zona in por_codigo.values():
+                indice.setdefault(cls._clave_nombre(zona.nombre), list()).append(zona)
+
+        cls._zonas_por_codigo = zonas
+        cls._provincias_de_ccaa = provincias_de_ccaa
+        cls._municipios_de_provincia = municipios_de_provincia
+        cls._jerarquia = {m.codigo: (m.provincia.codigo, m.ccaa.codigo) for m in municipios}
+        cls._indice_nombres = indice
+        cls._indice_difuso = None
+
+    @classmethod
+    def _get_indice(cls, nombre: str) -> Dict:
+        """Devuelve uno de los indices de referencia cargando los municipios si es necesario.
+
+        :param nombre: nombre del atributo de clase que contiene el indice.
+        :return: el indice solicitado.
+        """
+        if getattr(cls, nombre) is None:
+            cls.get_municipios()
+        return getattr(cls, nombre)
+
+    @classmethod
+    def get_zona(cls, tipo: type, codigo: int) -> Opt[U[Municipio, Provincia, CCAA]]:
+        """Obtiene una zona por su tipo y codigo.
+
+        :param tipo: tipo de zona (CCAA, Provincia o Municipio).
+        :param codigo: codigo de la zona.
+        :return: la zona o None si no existe.
+        """
+        return cls._get_indice('_zonas_por_codigo')[tipo].get(int(codigo))
 
     @classmethod
     def _consulta(cls, url) -> U[List, Dict]:
         datos = None
         try:
-            respuesta = safe_requests.get(url)
-            datos = respuesta.json()
+            respuesta = cls.cliente.get(url)
+            with metricas.medir('etapa', etapa='decodificar'):
+                datos = decodificar(respuesta.content)
         except Exception as err:
+            metricas.contar('errores', etapa='consulta')
             print(f' - [ERROR] {err}', file=sys.stderr)
-        return to_num(datos)
+        return datos
+
+    @classmethod
+    def _consulta_listado(cls, ruta: str) -> U[List, Dict]:
+        """Consulta un listado de referencia usando la cache en disco.
+
+        Si el listado guardado ha caducado se revalida con ETag/If-Modified-Since y, si el servidor no responde,
+        se usa la copia guardada aunque haya caducado.
+
+        :param ruta: ruta del listado relativa a REST_LISTADO (ej: "/Municipios/").
+        :return: datos del listado.
+        """
+        if cls.cache is None:
+            return cls._consulta(f'{st.REST_LISTADO}{ruta}')
+
+        datos, meta = cls.cache.leer(ruta)
+        if datos is not None and cls.cache.vigente(meta):
+            metricas.contar('cache', resultado='acierto')
+            return datos
+
+        cabeceras = cls.cache.cabeceras_validacion(meta) if datos is not None else dict()
+        try:
+            respuesta = cls.cliente.get(f'{st.REST_LISTADO}{ruta}', headers=cabeceras)
+            if respuesta.status_code == 304 and datos is not None:
+                metricas.contar('cache', resultado='revalidado')
+                cls.cache.renovar(ruta, datos, meta)
+                return datos
+            metricas.contar('cache', resultado='fallo')
+            with metricas.medir('etapa', etapa='decodificar'):
+                nuevos = decodificar(respuesta.content)
+        except Exception as err:
+            metricas.contar('errores', etapa='consulta')
+            print(f' - [ERROR] {err}', file=sys.stderr)
+            return datos
+
+        cls.cache.guardar(ruta, nuevos, respuesta.headers.get('ETag'), respuesta.headers.get('Last-Modified'))
+        return nuevos
+
+    @classmethod
+    def iter_estaciones(cls, ruta: str = None, filtro: Callable[[Estacion], bool] = None) -> Iterator[Estacion]:
+        """Descarga y analiza las estaciones de forma incremental.
+
+        La respuesta se lee por fragmentos y cada estacion se devuelve en cuanto se ha analizado, sin mantener en
+        memoria el documento completo ni la lista de estaciones.
+
+        :param ruta: ruta de un servicio de filtrado relativa a REST_ESTACION (ej: "Provincia/28"), por defecto
+                     el listado nacional.
+        :param filtro: funcion que recibe cada `Estacion` y decide si se devuelve.
+        :return: generador de estaciones (modelo compacto `Estacion`).
+        :raise ErrorConsulta: si la descarga o el analisis fallan, aunque sea a mitad del listado.
+        """
+        url = st.REST_ESTACIONES if ruta is None else f'{st.REST_ESTACION}{ruta}'
+
+        def fragmentos(respuesta):
+            for fragmento in respuesta.iter_content(chunk_size=64 * 1024):
+                metricas.contar('http_bytes', len(fragmento))
+                yield fragmento
+
+        construidas = 0
+        try:
+            with cls.cliente.get(url, stream=True) as respuesta:
+                for fila in iterar_lista(fragmentos(respuesta)):
+                    estacion = Estacion(**fila)
+                    construidas += 1
+                    if filtro is None or filtro(estacion):
+                        yield estacion
+        except Exception as err:
+            metricas.contar('errores', etapa='consulta')
+            # un listado incompleto no debe confundirse con uno completo
+            raise err if isinstance(err, ErrorConsulta) else ErrorConsulta(url, err) from err
+        finally:
+            metricas.contar('objetos', construidas, modelo='Estacion')
+
+    @classmethod
+    def get_mas_baratas(cls, producto: U[Producto, int], n: int = 10, ruta: str = None) -> List[Estacion]:
+        """Las `n` estaciones mas baratas para un producto usando la descarga incremental.
+
+        Solo se mantienen en memoria las `n` mejores estaciones encontradas hasta el momento.
+
+        :param producto: codigo del producto.
+        :param n: numero de estaciones a devolver.
+        :param ruta: ruta de un servicio de filtrado relativa a REST_ESTACION, por defecto el listado nacional.
+        :return: estaciones ordenadas de menor a mayor precio.
+        :raise ErrorConsulta: si el listado no se ha podido descargar completo.
+        """
+        producto = producto.codigo if isinstance(producto, Producto) else int(producto)
+        estaciones = cls.iter_estaciones(ruta, filtro=lambda e: e.precio(producto) is not None)
+        return heapq.nsmallest(n, estaciones, key=lambda e: e.precio(producto))
+
+    @staticmethod
+    def _clave_precio(producto: int) -> Callable[[U[EESS, Estacion]], Tuple[bool, float]]:
+        """Clave de ordenacion por precio de un producto que deja al final las estaciones sin precio."""
+        def clave(estacion):
+            precio = estacion.precio(producto)
+            return precio is None, precio or 0.0
+        return clave
+
+    @classmethod
+    def gestion_resultados_estaciones(cls, datos, zone_type, producto: int = PRODUCTO) -> Estaciones:
+        with metricas.medir('etapa', etapa='modelos'):
+            datos = [EESS(**d) for d in datos.get('ListaEESSPrecio')]
+        metricas.contar('objetos', len(datos), modelo='EESS')
+        with metricas.medir('etapa', etapa='enriquecer'):
+            for d in list(datos):
+                resultados = cls.buscar_por_nombre(getattr(d, zone_type.__name__.lower()))
+                for r in resultados:
+                    if isinstance(r, zone_type):
+                        setattr(d, zone_type.__name__.lower(), r)
+                        break
+        return Estaciones(sorted(datos, key=cls._clave_precio(producto)))
+
+    @classmethod
+    def get_snapshot(cls, forzar: bool = False) -> Snapshot:
+        """Obtiene la instantanea nacional de estaciones, descargandola si no existe o ha caducado.
+
+        Con `refresco_incremental` una instantanea existente se actualiza estacion a estacion y los cambios se
+        notifican a las funciones registradas con `suscribir`. Si la descarga falla se sigue usando la instantanea
+        anterior (vacia si aun no hay ninguna) y no se vuelve a intentar hasta pasados `reintento_snapshot` segundos.
+
+        :param forzar: descarga la instantanea aunque no haya caducado ni haya pasado la espera tras un fallo.
+        :return: instantanea nacional de estaciones.
+        """
+        if forzar or cls._snapshot_pendiente():
+            with cls._bloqueo_snapshot:
+                # otro hilo puede haberla descargado mientras se esperaba el bloqueo
+                if forzar or cls._snapshot_pendiente():
+                    datos = cls.descargar_snapshot()
+                    if datos:
+                        cls.aplicar_snapshot(datos)
+        # la instantanea vacia no se guarda, la siguiente consulta tras la espera vuelve a descargarla
+        return Snapshot(dict()) if cls._snapshot is None else cls._snapshot
+
+    @classmethod
+    def _snapshot_pendiente(cls) -> bool:
+        """True si la instantanea no existe o ha caducado y no se esta esperando tras una descarga fallida."""
+        vigente = cls._snapshot is not None and (cls.refresco_en_segundo_plano or
+                                                 not cls._snapshot.caducado(cls.intervalo_snapshot))
+        return not vigente and time.time() - cls._ultimo_fallo >= cls.reintento_snapshot
+
+    @classmethod
+    def descargar_snapshot(cls) -> Opt[Dict]:
+        """Descarga y decodifica el listado nacional de estaciones, sin modificar la instantanea vigente.
+
+        Una respuesta sin estaciones o con un resultado distinto de "OK" se trata como un fallo: aplicada como
+        refresco incremental eliminaria todas las estaciones.
+
+        :return: respuesta decodificada o None si la descarga ha fallado (se anota para `reintento_snapshot`).
+        """
+        datos = cls._consulta(st.REST_ESTACIONES)
+        if not isinstance(datos, dict):
+            datos = None if datos is None else dict(ResultadoConsulta=f'respuesta de tipo {type(datos).__name__}')
+        valida = datos is not None and isinstance(datos.get('ListaEESSPrecio'), list) and \
+            len(datos['ListaEESSPrecio']) > 0 and datos.get('ResultadoConsulta', 'OK') == 'OK'
+        if datos is not None and not valida:
+            metricas.contar('errores', etapa='instantanea')
+            print(f' - [ERROR] Listado nacional descartado: sin estaciones o ResultadoConsulta '
+                  f'"{str(datos.get("ResultadoConsulta"))[:200]}"', file=sys.stderr)
+        cls._ultimo_fallo = 0.0 if valida else time.time()
+        return datos if valida else None
+
+    @classmethod
+    def aplicar_snapshot(cls, datos: Dict) -> Snapshot:
+        """Sustituye o actualiza la instantanea nacional con un listado ya descargado.
+
+        :param datos: respuesta decodificada del servicio EstacionesTerrestres.
+        :return: instantanea nacional de estaciones.
+        """
+        if cls._snapshot is not None and cls.refresco_incremental:
+            cambios = cls._snapshot.actualizar(datos)
+            for suscriptor in cls._suscriptores:
+                suscriptor(cambios)
+        else:
+            cls._snapshot = Snapshot(datos)
+
+        if cls.historico is not None:
+            cls.historico.registrar(cls._snapshot.tabla, cls._snapshot.creado)
+        return cls._snapshot
+
+    @classmethod
+    def suscribir(cls, funcion: Callable[[Cambios], None]):
+        """Registra una funcion que recibira los cambios (`Cambios`) de cada refresco incremental.
+
+        :param funcion: funcion que recibe las estaciones añadidas, eliminadas, repreciadas y actualizadas.
+        """
+        cls._suscriptores.append(funcion)
+
+    @classmethod
+    def get_tabla_precios(cls) -> TablaPrecios:
+        """Tabla columnar de precios construida sobre la instantanea nacional.
+
+        :return: tabla de precios de la instantanea vigente.
+        """
+        return cls.get_snapshot().tabla
+
+    @classmethod
+    def get_estadisticas(cls) -> Estadisticas:
+        """Estadisticas de precio por producto de todos los municipios, provincias, comunidades y del pais.
+
+        Se calculan en una sola pasada sobre la instantanea nacional usando la jerarquia de `get_municipios` y se
+        reutilizan hasta el siguiente refresco.
+
+        :return: estadisticas de la instantanea vigente.
+        """
+        tabla = cls.get_tabla_precios()
+        return tabla.estadisticas(cls._get_indice('_jerarquia'))
+
+    @classmethod
+    def get_resumen(cls, producto: U[Producto, int], zona: U[Municipio, Provincia, CCAA] = None) -> Opt[Resumen]:
+        """Minimo, maximo, media, mediana, p10 y p90 del precio de un producto en una zona o en todo el pais.
+
+        :param producto: codigo del producto.
+        :param zona: municipio, provincia o comunidad autonoma, todo el pais si no se indica.
+        :return: resumen o None si ninguna estacion de la zona vende el producto.
+        """
+        producto = producto.codigo if isinstance(producto, Producto) else int(producto)
+        if zona is None:
+            return cls.get_estadisticas().resumen(producto)
+        return cls.get_estadisticas().resumen(producto, type(zona).__name__.lower(), int(zona.codigo))
 
     @classmethod
-    def gestion_resultados_estaciones(cls, datos, zone_type) -> Estaciones:
-        datos = [EESS(**d) for d in datos.get('ListaEESSPrecio')]
-        for d in list(datos):
-            resultados = cls.buscar_por_nombre(getattr(d, zone_type.__name__.lower()))
-            for r in resultados:
-                if isinstance(r, zone_type):
-                    setattr(d, zone_type.__name__.lower(), r)
-                    break
-        return Estaciones(*[sorted(datos, key=lambda e: e.precio_gasolina_95)])
+    def get_cercanas(cls, lat: float, lon: float, k: int = 10) -> List[Tuple[Estacion, float]]:
+        """Las `k` estaciones mas cercanas a un punto (sobre la instantanea nacional).
+
+        :param lat: latitud WGS84.
+        :param lon: longitud WGS84.
+        :param k: numero de estaciones.
+        :return: lista de tuplas (estacion, distancia en km) ordenada por distancia.
+        """
+        tabla = cls.get_tabla_precios()
+        return [(Estacion(**tabla.filas[i]), d) for i, d in tabla.espacial.cercanos(lat, lon, k)]
+
+    @classmethod
+    def get_mas_baratas_en_radio(cls, lat: float, lon: float, radio: float, producto: U[Producto, int],
+                                 n: int = 10) -> List[Tuple[Estacion, float]]:
+        """Las `n` estaciones mas baratas para un producto a menos de `radio` km de un punto.
+
+        A diferencia de las consultas por municipio incluye las estaciones de los municipios vecinos.
+
+        :param lat: latitud WGS84.
+        :param lon: longitud WGS84.
+        :param radio: radio de busqueda en km.
+        :param producto: codigo del producto.
+        :param n: numero de estaciones.
+        :return: lista de tuplas (estacion, distancia en km) ordenada por precio.
+        """
+        producto = producto.codigo if isinstance(producto, Producto) else int(producto)
+        tabla = cls.get_tabla_precios()
+        return [(Estacion(**tabla.filas[i]), d) for i, d in tabla.mas_baratas_en_radio(lat, lon, radio, producto, n)]
+
+    @classmethod
+    def get_estaciones_en_ruta(cls, ruta: List[Tuple[float, float]], buffer: float, producto: U[Producto, int],
+                               n: int = 10) -> List[Tuple[Estacion, float, float]]:
+        """Las `n` estaciones mas baratas para un producto a lo largo de una ruta (sobre la instantanea nacional).
+
+        :param ruta: lista de puntos (lat, lon) WGS84 en orden de recorrido.
+        :param buffer: distancia maxima a la ruta en km.
+        :param producto: codigo del producto.
+        :param n: numero de estaciones.
+        :return: lista de tuplas (estacion, km recorridos hasta la estacion, desvio en km) ordenada por precio y
+                 por km recorridos.
+        """
+        producto = producto.codigo if isinstance(producto, Producto) else int(producto)
+        tabla = cls.get_tabla_precios()
+        return [(Estacion(**tabla.filas[i]), km, desvio)
+                for i, km, desvio in tabla.mas_baratas_en_ruta(ruta, buffer, producto, n)]
+
+    @classmethod
+    def _estaciones_snapshot(cls, zone_type: type, codigo: int, producto: int = None) -> Estaciones:
+        """Estaciones de una zona y/o producto resueltas sobre la instantanea nacional.
+
+        Los objetos `EESS` se construyen una sola vez por estacion y se reutilizan entre consultas y refrescos
+        mientras la estacion no cambie.
+
+        :param zone_type: tipo de zona usado como filtro (CCAA, Provincia o Municipio).
+        :param codigo: codigo de la zona.
+        :param producto: codigo del producto.
+        :return: estaciones ordenadas por precio.
+        """
+        snapshot = cls.get_snapshot()
+        # las zonas de referencia deben estar cargadas para que EESS use las instancias canonicas
+        cls.get_municipios()
+        if producto is not None:
+            # las estaciones con el producto ya estan ordenadas en el ranking precalculado de la zona
+            indices = snapshot.tabla.top(producto, **{zone_type.__name__.lower(): codigo})
+            return Estaciones([snapshot.objeto(i, lambda fila: EESS(**fila)) for i in indices])
+        indices = snapshot.indices(f'ID{zone_type.__name__}', codigo)
+        datos = [snapshot.objeto(i, lambda fila: EESS(**fila)) for i in indices]
+        return Estaciones(sorted(datos, key=cls._clave_precio(PRODUCTO)))
+
+    @classmethod
+    def _consulta_estaciones(cls, ruta: str, zone_type: type, codigo: int, producto: int = None) -> Estaciones:
+        """Consulta las estaciones de una zona y/o producto.
+
+        En modo instantanea el filtro se resuelve localmente, si no se consulta el servicio REST de filtrado.
+
+        :param ruta: ruta del servicio de filtrado relativa a REST_ESTACION.
+        :param zone_type: tipo de zona usado como filtro (CCAA, Provincia o Municipio).
+        :param codigo: codigo de la zona.
+        :param producto: codigo del producto.
+        :return: estaciones ordenadas por precio.
+        """
+        if cls.modo_snapshot:
+            return cls._estaciones_snapshot(zone_type, codigo, producto)
+        datos = cls._consulta(f'{st.REST_ESTACION}{ruta}')
+        return cls.gestion_resultados_estaciones(datos, zone_type, PRODUCTO if producto is None else producto)
+
+    @classmethod
+    def get_ranking(cls, producto: U[Producto, int], zona: U[Municipio, Provincia, CCAA] = None,
+                    n: int = 10) -> Estaciones:
+        """Las `n` estaciones mas baratas para un producto en todo el pais o en una zona.
+
+        Sin zona, o en modo instantanea, el resultado es un tramo del ranking precalculado de la tabla de precios;
+        si no se consulta el servicio REST de la zona y producto y se seleccionan las `n` primeras con un heap.
+
+        :param producto: codigo del producto.
+        :param zona: municipio, provincia o comunidad autonoma, todo el pais si no se indica.
+        :param n: numero de estaciones, todas si es None.
+        :return: estaciones ordenadas de menor a mayor precio.
+        """
+        producto = producto.codigo if isinstance(producto, Producto) else int(producto)
+        if zona is not None and not cls.modo_snapshot:
+            datos = cls._consulta(f'{st.REST_ESTACION}{cls._ruta_filtro(zona, producto)}') or dict()
+            estaciones = [EESS(**d) for d in datos.get('ListaEESSPrecio') or list()]
+            estaciones = [e for e in estaciones if e.precio(producto) is not None]
+            if n is None:
+                return Estaciones(sorted(estaciones, key=lambda e: e.precio(producto)))
+            return Estaciones(heapq.nsmallest(n, estaciones, key=lambda e: e.precio(producto)))
+
+        snapshot = cls.get_snapshot()
+        cls.get_municipios()
+        filtro = dict() if zona is None else {type(zona).__name__.lower(): int(zona.codigo)}
+        indices = snapshot.tabla.top(producto, n, **filtro)
+        return Estaciones([snapshot.objeto(i, lambda fila: EESS(**fila)) for i in indices])
 
     @classmethod
     def get_estaciones_por_producto(cls, producto: U[Producto, int]) -> Estaciones:
@@ -54,47 +480,94 @@ class InfoCombustible:
         :return: todas las estaciones que tienen el producto solicitado.
         """
         producto = producto.codigo if isinstance(producto, Producto) else int(producto)
+        if cls.modo_snapshot:
+            return cls.get_snapshot().filtrar(producto=producto)
         data = cls._consulta(f'{st.REST_ESTACION}Producto/{producto:02d}')
         return data
 
     @classmethod
     def get_estaciones_por_ccaa(cls, ccaa: U[CCAA, int]) -> Estaciones:
         ccaa = ccaa.codigo if isinstance(ccaa, CCAA) else int(ccaa)
-        data = cls._consulta(f'{st.REST_ESTACION}CCAA/{ccaa:02d}')
-        return cls.gestion_resultados_estaciones(data, CCAA)
+        return cls._consulta_estaciones(f'CCAA/{ccaa:02d}', CCAA, ccaa)
 
     @classmethod
     def get_estaciones_por_provincia(cls, provincia: U[Provincia, int]) -> Estaciones:
         provincia = provincia.codigo if isinstance(provincia, Provincia) else int(provincia)
-        data = cls._consulta(f'{st.REST_ESTACION}Provincia/{provincia:02d}')
-        return cls.gestion_resultados_estaciones(data, Provincia)
+        return cls._consulta_estaciones(f'Provincia/{provincia:02d}', Provincia, provincia)
 
     @classmethod
     def get_estaciones_por_municipio(cls, municipio: U[Municipio, int]) -> Estaciones:
         municipio = municipio.codigo if isinstance(municipio, Municipio) else int(municipio)
-        data = cls._consulta(f'{st.REST_ESTACION}Municipio/{municipio:04d}')
-        return cls.gestion_resultados_estaciones(data, Municipio)
+        return cls._consulta_estaciones(f'Municipio/{municipio:04d}', Municipio, municipio)
 
     @classmethod
     def get_estaciones_por_ccaa_y_producto(cls, ccaa: U[CCAA, int], producto: U[Producto, int]) -> Estaciones:
         producto = producto.codigo if isinstance(producto, Producto) else int(producto)
         ccaa = ccaa.codigo if isinstance(ccaa, CCAA) else int(ccaa)
-        data = cls._consulta(f'{st.REST_ESTACION}CCAAProducto/{ccaa:02d}/{producto:02d}')
-        return cls.gestion_resultados_estaciones(data, CCAA)
+        return cls._consulta_estaciones(f'CCAAProducto/{ccaa:02d}/{producto:02d}', CCAA, ccaa, producto)
 
     @classmethod
     def get_estaciones_por_provincia_y_producto(cls, provincia, producto: U[Producto, int]) -> Estaciones:
         producto = producto.codigo if isinstance(producto, Producto) else int(producto)
         provincia = provincia.codigo if isinstance(provincia, Provincia) else int(provincia)
-        data = cls._consulta(f'{st.REST_ESTACION}ProvinciaProducto/{provincia:02d}/{producto:02d}')
-        return cls.gestion_resultados_estaciones(data, Provincia)
+        return cls._consulta_estaciones(f'ProvinciaProducto/{provincia:02d}/{producto:02d}', Provincia, provincia,
+                                        producto)
 
     @classmethod
     def get_estaciones_por_municio_y_producto(cls, municipio, producto) -> Estaciones:
-        municipio = municipio.codigo if isinstance(municipio, Provincia) else int(municipio)
+        municipio = municipio.codigo if isinstance(municipio, Municipio) else int(municipio)
         producto = producto.codigo if isinstance(producto, Producto) else int(producto)
-        data = cls._consulta(f'{st.REST_ESTACION}MunicipioProducto/{municipio:04d}/{producto:02d}')
-        return cls.gestion_resultados_estaciones(data, Municipio)
+        return cls._consulta_estaciones(f'MunicipioProducto/{municipio:04d}/{producto:02d}', Municipio, municipio,
+                                        producto)
+
+    @staticmethod
+    def _ruta_filtro(zona: U[Municipio, Provincia, CCAA], producto: int = None) -> str:
+        """Ruta del servicio REST de filtrado para una zona y, opcionalmente, un producto.
+
+        :param zona: zona usada como filtro.
+        :param producto: codigo del producto.
+        :return: ruta relativa a REST_ESTACION.
+        """
+        tipo = type(zona).__name__
+        codigo = f'{int(zona.codigo):04d}' if isinstance(zona, Municipio) else f'{int(zona.codigo):02d}'
+        return f'{tipo}/{codigo}' if producto is None else f'{tipo}Producto/{codigo}/{producto:02d}'
+
+    @classmethod
+    def get_estaciones_en_bloque(cls, consultas: Iterable[U[Zona, Tuple[Zona, U[Producto, int, None]]]],
+                                 concurrencia: int = 8) -> List[Resultado]:
+        """Consulta en paralelo las estaciones de muchas zonas (y productos).
+
+        Las peticiones comparten la sesion HTTP de `cliente` (keep-alive, timeout y reintentos con espera
+        exponencial) y como mucho se ejecutan `concurrencia` a la vez. En modo instantanea se resuelven localmente.
+
+        :param consultas: zonas o pares (zona, producto); el producto puede ser None.
+        :param concurrencia: numero maximo de peticiones simultaneas.
+        :return: un `Resultado` por consulta, en el mismo orden, con las estaciones en `datos` o el motivo del
+                 fallo en `error`.
+        """
+        consultas = [c if isinstance(c, tuple) else (c, None) for c in consultas]
+
+        def consultar(consulta) -> Resultado:
+            zona, producto = consulta
+            producto = producto.codigo if isinstance(producto, Producto) else producto
+            producto = None if producto is None else int(producto)
+            try:
+                if cls.modo_snapshot:
+                    return Resultado(consulta, cls._estaciones_snapshot(type(zona), int(zona.codigo), producto))
+                respuesta = cls.cliente.get(f'{st.REST_ESTACION}{cls._ruta_filtro(zona, producto)}')
+                datos = decodificar(respuesta.content)
+                return Resultado(consulta, cls.gestion_resultados_estaciones(
+                    datos, type(zona), PRODUCTO if producto is None else producto))
+            except Exception as err:
+                # cualquier fallo (red, respuesta mal formada, url rechazada...) queda en el resultado de su consulta
+                return Resultado(consulta, error=str(err) or type(err).__name__)
+
+        # los datos compartidos se cargan una sola vez antes de repartir las consultas entre los hilos
+        cls.get_municipios()
+        if cls.modo_snapshot:
+            cls.get_snapshot()
+        with ThreadPoolExecutor(max_workers=max(1, concurrencia)) as ejecutor:
+            return list(ejecutor.map(consultar, consultas))
 
     @classmethod
     def get_productos(cls) -> Productos:
@@ -105,9 +578,17 @@ class InfoCombustible:
 
         :return:
         """
+        return Productos([Producto(**p) for p in cls._listado_productos()])
+
+    @classmethod
+    def _listado_productos(cls) -> List[Dict]:
+        """Listado de productos en bruto, vacio si no se ha podido descargar (se reintenta en la siguiente llamada)."""
         if cls._productos is None or len(cls._productos) == 0:
-            cls._productos = cls._consulta(f'{st.REST_LISTADO}/ProductosPetroliferos/')
-        return Productos(*[Producto(**p) for p in cls._productos])
+            cls._productos = cls._consulta_listado('/ProductosPetroliferos/')
+            if cls._productos:
+                # el indice difuso pudo construirse sin productos mientras el listado no estaba disponible
+                cls._indice_difuso = None
+        return cls._productos or list()
 
     @classmethod
     def get_comunidades_autonomas(cls) -> Autonomias:
@@ -118,14 +599,15 @@ class InfoCombustible:
 
         :return:
         """
-        return Autonomias(*{m.ccaa for m in cls.get_municipios()})
+        return Autonomias(list(cls._get_indice('_zonas_por_codigo')[CCAA].values()))
         # data = self._consulta(f'{st.REST_LISTADO}/ComunidadesAutonomas/')
 
     @classmethod
-    def get_provincias(cls, ccaa: U[Provincia, int] = None) -> Provincias:
+    def get_provincias(cls, ccaa: U[CCAA, int] = None) -> Provincias:
         # data = cls._consulta(f'{st.REST_LISTADO}/Provincias/')
-        ccaa = ccaa.codigo if isinstance(ccaa, CCAA) else int(ccaa)
-        return Provincias(*{p.provincia for p in cls.get_municipios() if ccaa is None or p.ccaa == ccaa})
+        if ccaa is None:
+            return Provincias(list(cls._get_indice('_zonas_por_codigo')[Provincia].values()))
+        return cls.get_provincias_por_ccaa(ccaa)
 
     @classmethod
     def get_municipios(cls) -> Municipios:
@@ -134,62 +616,104 @@ class InfoCombustible:
         >>> all(isinstance(m, Municipio) for m in InfoCombustible.get_municipios())
         True
 
-        :return: datos de referencia de todos los municipios.
+        :return: datos de referencia de todos los municipios, vacio si no se han podido descargar ni hay copia en
+                 la cache (se reintenta en la siguiente llamada).
         """
         if cls._municipios is None or len(cls._municipios) == 0:
-            cls._municipios = Municipios([Municipio(**i) for i in cls._consulta(f'{st.REST_LISTADO}/Municipios/')])
+            with cls._bloqueo_municipios:
+                # otro hilo puede haberlos cargado mientras se esperaba el bloqueo
+                if cls._municipios is None or len(cls._municipios) == 0:
+                    listado = cls._consulta_listado('/Municipios/') or list()
+                    municipios = Municipios([Municipio.canonica(**i) for i in listado])
+                    # con el listado vacio los indices quedan vacios (las busquedas no encuentran nada); se publican
+                    # antes que los municipios para que ningun hilo vea municipios cargados sin indices
+                    cls._indexar(municipios)
+                    cls._municipios = municipios
         return cls._municipios
 
     @classmethod
     def get_provincias_por_ccaa(cls, ccaa: U[CCAA, int]) -> Provincias:
         ccaa = ccaa.codigo if isinstance(ccaa, CCAA) else int(ccaa)
-        return Provincias(*{p.provincia for p in cls.get_municipios() if p.ccaa == ccaa})
+        return Provincias(list(cls._get_indice('_provincias_de_ccaa').get(ccaa, list())))
         # return cls.gestion_resultados_estaciones(data)ls._consulta(f'{st.REST_LISTADO}/ProvinciasPorComunidad/{int(ccaa):02d}')
 
     @classmethod
     def get_municipios_por_provincia(cls, provincia: U[Provincia, int]) -> Municipios:
         provincia = provincia.codigo if isinstance(provincia, Provincia) else int(provincia)
-        return Municipios(*{p for p in cls.get_municipios() if p.provincia == provincia})
+        return Municipios(list(cls._get_indice('_municipios_de_provincia').get(provincia, list())))
         # return cls.gestion_resultados_estaciones(data)ls._consulta(f'{st.REST_LISTADO}/MunicipiosPorProvincia/{int(provincia):02d}')
 
     @classmethod
     def buscar_por_nombre(cls, nombre) -> U[List[U[Municipio, Provincia, CCAA]], U[Municipio, Provincia, CCAA]]:
-        resultados = list()
-        nombre = enmendar(normalizar(str(nombre).strip()))
-
-        # if isinstance(nombre, str) and len(nombre) >= 0:
-        for m in cls.get_municipios():
-            m_name = enmendar(normalizar(m.nombre)).lower()
-            p_name = enmendar(normalizar(m.provincia.nombre)).lower()
-            c_name = enmendar(normalizar(m.ccaa.nombre)).lower()
-            if m_name == nombre.casefold():
-                resultados.append(m)
-            if p_name == nombre.casefold():
-                resultados.append(m.provincia)
-            if c_name == nombre.casefold():
-                resultados.append(m.ccaa)
+        """Busca municipios, provincias y comunidades autonomas por su nombre.
+
+        La busqueda se resuelve mediante un indice construido al cargar los municipios.
+
+        :param nombre: nombre de la zona buscada (se ignoran acentos, mayusculas y articulos).
+        :return: la zona encontrada o una lista con todas las coincidencias.
+        """
+        resultados = list(cls._get_indice('_indice_nombres').get(cls._clave_nombre(nombre), list()))
+        metricas.contar('busquedas', tipo='nombre', resultado='encontrada' if resultados else 'no_encontrada')
 
         if len(resultados) == 1:
             return resultados[0]
         else:
-            return sorted(set(resultados))
+            return sorted(resultados)
+
+    @classmethod
+    def get_indice_difuso(cls) -> IndiceDifuso:
+        """Indice de prefijos y trigramas sobre los nombres de municipios, provincias, comunidades y productos.
+
+        Usa la misma normalizacion que `buscar_por_nombre` y se construye una sola vez con los datos de referencia.
+
+        :return: indice de busqueda aproximada.
+        """
+        if cls._indice_difuso is None:
+            zonas = cls._get_indice('_zonas_por_codigo')
+            indice = IndiceDifuso(cls._clave_nombre)
+            for tipo in (CCAA, Provincia, Municipio):
+                for zona in zonas[tipo].values():
+                    indice.anadir(zona.nombre, zona)
+            # sin listado de productos (ej: servicio caido) se indexan solo las zonas
+            for producto in cls.get_productos():
+                indice.anadir(producto.nombre, producto)
+                if producto.descripcion:
+                    indice.anadir(producto.descripcion, producto)
+            indice.preparar()
+            cls._indice_difuso = indice
+        return cls._indice_difuso
+
+    @classmethod
+    def autocompletar(cls, texto: str, n: int = 10, tipos: Iterable[type] = None) -> List[Coincidencia]:
+        """Sugerencias para un texto incompleto o con erratas (ej: "sebas", "madird", "gasoleo").
+
+        :param texto: texto escrito hasta el momento.
+        :param n: numero maximo de sugerencias.
+        :param tipos: tipos admitidos (Municipio, Provincia, CCAA y/o Producto), todos si no se indican.
+        :return: coincidencias (objeto, tipo, puntuacion) ordenadas de mejor a peor.
+        """
+        metricas.contar('busquedas', tipo='difusa')
+        return cls.get_indice_difuso().buscar(texto, n, tipos)
 
     @classmethod
     def buscar_por_codigo(cls, *args) -> U[List[U[Municipio, Provincia, CCAA]], U[Municipio, Provincia, CCAA]]:
-        resultados = list()
+        """Busca municipios, provincias y comunidades autonomas por su codigo.
+
+        :param args: codigos buscados, un mismo codigo puede coincidir con zonas de distinto tipo.
+        :return: la zona encontrada o una lista con todas las coincidencias.
+        """
+        zonas = cls._get_indice('_zonas_por_codigo')
         codigos = [int(c) for c in args if (isinstance(c or [], int) or str(c).isnumeric()) and int(c) > 0]
-        for m in cls.get_municipios():
-            if any(m.codigo == c for c in codigos):
-                resultados.append(m)
-            if any(m.provincia.codigo == c for c in codigos):
-                resultados.append(m.provincia)
-            if any(m.ccaa.codigo == c for c in codigos):
-                resultados.append(m.ccaa)
+        resultados = list()
+        for c in dict.fromkeys(codigos):
+            for tipo in (Municipio, Provincia, CCAA):
+                if c in zonas[tipo]:
+                    resultados.append(zonas[tipo][c])
 
         if len(resultados) == 1:
             return resultados[0]
         else:
-            return sorted(set(resultados))
+            return sorted(resultados)
 
     @classmethod
     def buscar_producto(cls, *args) -> U[Productos, Producto]:
@@ -205,3 +729,5 @@ class InfoCombustible:
         else:
             return Productos(*set(resultados))
 
+
+Estacion.resolver_zona = InfoCombustible.get_zona
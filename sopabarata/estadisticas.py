@@ -0,0 +1,119 @@
+# -*- coding:utf-8 -*-
+import math
+from typing import Dict, NamedTuple, Optional as Opt, Sequence, Tuple
+
+# niveles de agregacion, de mayor a menor (el pais tiene siempre el codigo 0)
+NIVELES = 'pais', 'ccaa', 'provincia', 'municipio'
+
+Jerarquia = Dict[int, Tuple[int, int]]
+
+
+class Resumen(NamedTuple):
+    """Estadisticas de precio de un producto en una zona."""
+
+    estaciones: int
+    minimo: float
+    maximo: float
+    media: float
+    mediana: float
+    p10: float
+    p90: float
+
+
+def percentil(ordenados: Sequence[float], p: float) -> float:
+    """Percentil con interpolacion lineal entre posiciones (mismo criterio que numpy.percentile).
+
+    >>> percentil([1.0, 2.0, 3.0, 4.0], 0.5)
+    2.5
+
+    :param ordenados: valores ordenados de menor a mayor.
+    :param p: percentil entre 0 y 1.
+    :return: valor del percentil.
+    """
+    posicion = (len(ordenados) - 1) * p
+    bajo = math.floor(posicion)
+    alto = min(bajo + 1, len(ordenados) - 1)
+    return ordenados[bajo] + (ordenados[alto] - ordenados[bajo]) * (posicion - bajo)
+
+
+def resumir(ordenados: Sequence[float]) -> Opt[Resumen]:
+    """Resumen de una lista de precios ya ordenada.
+
+    :param ordenados: precios ordenados de menor a mayor.
+    :return: resumen con los precios redondeados a milesimas o None si no hay precios.
+    """
+    if not ordenados:
+        return None
+    if len(ordenados) == 1:
+        # caso mas frecuente en municipios pequeños
+        valor = round(ordenados[0], 3)
+        return Resumen(1, valor, valor, valor, valor, valor, valor)
+    valores = (ordenados[0], ordenados[-1], math.fsum(ordenados) / len(ordenados), percentil(ordenados, 0.5),
+               percentil(ordenados, 0.1), percentil(ordenados, 0.9))
+    return Resumen(len(ordenados), *[round(v, 3) for v in valores])
+
+
+class Estadisticas:
+    """Estadisticas de precio (minimo, maximo, media, mediana, p10 y p90) por producto para cada municipio,
+    provincia, comunidad autonoma y para todo el pais.
+
+    Se calculan en una sola pasada por producto sobre el ranking nacional de la tabla de precios: al recorrerlo en
+    orden cada zona recibe sus precios ya ordenados, por lo que medianas y percentiles no requieren ordenar nada.
+    """
+
+    def __init__(self, tabla, jerarquia: Jerarquia = None):
+        """Constructor.
+
+        :param tabla: tabla de precios (`TablaPrecios`).
+        :param jerarquia: codigo de municipio -> (codigo de provincia, codigo de CCAA); para los municipios que no
+                          aparecen se usan los codigos de zona de cada estacion.
+        """
+        jerarquia = jerarquia or dict()
+        self._resumenes: Dict[str, Dict[int, Dict[int, Resumen]]] = {nivel: dict() for nivel in NIVELES}
+        for producto, precios in tabla.precios.items():
+            ranking = tabla.ranking(producto)
+            grupos = {nivel: dict() for nivel in NIVELES[1:]}
+            for i in ranking:
+                municipio, precio = tabla.municipio[i], precios[i]
+                provincia, ccaa = jerarquia.get(municipio) or (tabla.provincia[i], tabla.ccaa[i])
+                grupos['ccaa'].setdefault(ccaa, list()).append(precio)
+                grupos['provincia'].setdefault(provincia, list()).append(precio)
+                grupos['municipio'].setdefault(municipio, list()).append(precio)
+            grupos['pais'] = {0: [precios[i] for i in ranking]}
+            for nivel, por_codigo in grupos.items():
+                for codigo, ordenados in por_codigo.items():
+                    resumen = resumir(ordenados)
+                    if resumen is not None:
+                        self._resumenes[nivel].setdefault(codigo, dict())[producto] = resumen
+
+    def resumen(self, producto: int, nivel: str = 'pais', codigo: int = 0) -> Opt[Resumen]:
+        """Estadisticas de un producto en una zona.
+
+        :param producto: codigo de producto.
+        :param nivel: "pais", "ccaa", "provincia" o "municipio".
+        :param codigo: codigo de la zona (0 para el pais).
+        :return: resumen o None si ninguna estacion de la zona vende el producto.
+        """
+        return self.zona(nivel, codigo).get(int(producto))
+
+    def zona(self, nivel: str = 'pais', codigo: int = 0) -> Dict[int, Resumen]:
+        """Estadisticas de todos los productos en una zona.
+
+        :param nivel: "pais", "ccaa", "provincia" o "municipio".
+        :param codigo: codigo de la zona (0 para el pais).
+        :return: diccionario codigo de producto -> resumen.
+        """
+        if nivel not in NIVELES:
+            raise ValueError(f'Nivel de zona no valido: {nivel}')
+        return self._resumenes[nivel].get(int(codigo), dict())
+
+    def nivel(self, nivel: str, producto: int) -> Dict[int, Resumen]:
+        """Estadisticas de un producto en todas las zonas de un nivel (ej: todas las provincias).
+
+        :param nivel: "pais", "ccaa", "provincia" o "municipio".
+        :param producto: codigo de producto.
+        :return: diccionario codigo de zona -> resumen.
+        """
+        if nivel not in NIVELES:
+            raise ValueError(f'Nivel de zona no valido: {nivel}')
+        return {codigo: r[int(producto)] for codigo, r in self._resumenes[nivel].items() if int(producto) in r}
@@ -0,0 +1,166 @@
+# -*- coding:utf-8 -*-
+import heapq
+import math
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+RADIO_TIERRA = 6371.0088
+KM_POR_GRADO = math.pi * RADIO_TIERRA / 180
+
+
+def distancia(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia en km entre dos puntos WGS84 (formula del haversine).
+
+    >>> round(distancia(40.4168, -3.7038, 41.3874, 2.1686))
+    505
+
+    :return: distancia en kilometros.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA * math.asin(math.sqrt(a))
+
+
+class IndiceEspacial:
+    """Indice espacial de rejilla regular (celdas de `celda` grados) sobre coordenadas WGS84.
+
+    Los puntos se identifican por su posicion en las secuencias de latitudes y longitudes, que se corresponden con
+    los indices de fila de `TablaPrecios`. Los puntos sin coordenadas se ignoran.
+
+    Puntos a ambos lados de los bordes de celda (40,00 y -3,00) alrededor del centro (40, -3):
+
+    >>> latitudes = [40.001, 39.999, 40.049, 40.2, float('nan'), 39.96]
+    >>> longitudes = [-3.001, -2.999, -3.0, -3.0, float('nan'), -3.07]
+    >>> indice = IndiceEspacial(latitudes, longitudes)
+    >>> len(indice), [(i, round(d, 2)) for i, d in indice.en_radio(40, -3, 6)]
+    (5, [(0, 0.14), (1, 0.14), (2, 5.45)])
+    >>> [(i, round(d, 2)) for i, d in indice.cercanos(40, -3, 4)]
+    [(0, 0.14), (1, 0.14), (2, 5.45), (5, 7.44)]
+    >>> fuerza_bruta = sorted((distancia(40, -3, la, lo), i) for i, (la, lo) in enumerate(zip(latitudes, longitudes))
+    ...                       if la == la)
+    >>> [i for i, _ in indice.cercanos(40, -3, 5)] == [i for _, i in fuerza_bruta]
+    True
+    """
+
+    def __init__(self, latitudes: Sequence[float], longitudes: Sequence[float], celda: float = 0.05):
+        """Constructor.
+
+        :param latitudes: latitud de cada punto (NaN o None si no tiene).
+        :param longitudes: longitud de cada punto (NaN o None si no tiene).
+        :param celda: tamaño de celda en grados (0.05 grados son ~5,5 km de latitud).
+        """
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.celda = celda
+        self._celdas: Dict[Tuple[int, int], List[int]] = dict()
+        for i, (lat, lon) in enumerate(zip(latitudes, longitudes)):
+            if lat is not None and lon is not None and lat == lat and lon == lon:
+                self._celdas.setdefault(self._clave(lat, lon), list()).append(i)
+        claves = list(self._celdas) or [(0, 0)]
+        self._limites = min(c[0] for c in claves), max(c[0] for c in claves), \
+            min(c[1] for c in claves), max(c[1] for c in claves)
+
+    def __len__(self):
+        return sum(map(len, self._celdas.values()))
+
+    def _clave(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.celda), math.floor(lon / self.celda)
+
+    def _km_celda(self, lat: float) -> float:
+        """Lado minimo de una celda en km alrededor de la latitud indicada."""
+        cos = math.cos(math.radians(min(abs(lat) + self.celda, 89.0)))
+        return self.celda * KM_POR_GRADO * cos
+
+    def _anillo(self, fila: int, columna: int, n: int) -> Iterable[int]:
+        """Puntos de las celdas situadas exactamente a `n` celdas (distancia de Chebyshev) de la celda dada."""
+        for f in range(fila - n, fila + n + 1):
+            paso = 1 if f in (fila - n, fila + n) else 2 * n or 1
+            for c in range(columna - n, columna + n + 1, paso):
+                yield from self._celdas.get((f, c), ())
+
+    def _anillos_maximos(self, fila: int, columna: int) -> int:
+        fmin, fmax, cmin, cmax = self._limites
+        return max(fila - fmin, fmax - fila, columna - cmin, cmax - columna, 0)
+
+    def en_radio(self, lat: float, lon: float, radio: float) -> List[Tuple[int, float]]:
+        """Puntos a menos de `radio` km, ordenados por distancia.
+
+        :param lat: latitud del centro.
+        :param lon: longitud del centro.
+        :param radio: radio en km.
+        :return: lista de tuplas (indice, distancia en km).
+        """
+        fila, columna = self._clave(lat, lon)
+        anillos = math.ceil(radio / self._km_celda(lat + radio / KM_POR_GRADO))
+        anillos = min(anillos, self._anillos_maximos(fila, columna))
+        resultado = list()
+        for n in range(anillos + 1):
+            for i in self._anillo(fila, columna, n):
+                d = distancia(lat, lon, self.latitudes[i], self.longitudes[i])
+                if d <= radio:
+                    resultado.append((i, d))
+        return sorted(resultado, key=lambda r: r[1])
+
+    def cercanos(self, lat: float, lon: float, k: int = 10) -> List[Tuple[int, float]]:
+        """Los `k` puntos mas cercanos, recorriendo anillos de celdas hasta garantizar el resultado.
+
+        :param lat: latitud del centro.
+        :param lon: longitud del centro.
+        :param k: numero de puntos.
+        :return: lista de tuplas (indice, distancia en km) ordenada por distancia.
+        """
+        fila, columna = self._clave(lat, lon)
+        km_celda = self._km_celda(lat)
+        mejores = list()
+        for n in range(self._anillos_maximos(fila, columna) + 1):
+            for i in self._anillo(fila, columna, n):
+                d = distancia(lat, lon, self.latitudes[i], self.longitudes[i])
+                if len(mejores) < k:
+                    heapq.heappush(mejores, (-d, i))
+                elif -mejores[0][0] > d:
+                    heapq.heapreplace(mejores, (-d, i))
+            # todo punto fuera de los anillos recorridos esta al menos a n * km_celda
+            if len(mejores) >= k and -mejores[0][0] <= n * km_celda:
+                break
+        return sorted(((i, -d) for d, i in mejores), key=lambda r: r[1])
+
+    def en_corredor(self, ruta: Sequence[Tuple[float, float]], buffer: float) -> List[Tuple[int, float, float]]:
+        """Puntos a menos de `buffer` km de una ruta (polilinea de puntos lat/lon).
+
+        Cada tramo se proyecta en un plano local (equirectangular) y solo se examinan las celdas de su rectangulo
+        envolvente ampliado con el buffer.
+
+        Ruta de dos tramos: 22,2 km hacia el norte por el meridiano -3 y luego hacia el este por el paralelo 40,1.
+
+        >>> indice = IndiceEspacial([40.001, 39.999, 40.049, 40.2, 40.105], [-3.001, -2.999, -3.0, -3.0, -2.9])
+        >>> ruta = [(39.9, -3.0), (40.1, -3.0), (40.1, -2.8)]
+        >>> [(i, round(km, 1), round(desvio, 2)) for i, km, desvio in indice.en_corredor(ruta, 1)]
+        [(1, 11.0, 0.09), (0, 11.2, 0.09), (2, 16.6, 0.0), (4, 30.7, 0.56)]
+
+        :param ruta: lista de puntos (lat, lon) en orden de recorrido.
+        :param buffer: distancia maxima a la ruta en km.
+        :return: lista de tuplas (indice, km recorridos hasta el punto mas cercano de la ruta, desvio en km)
+                 ordenada por km recorridos.
+        """
+        mejores: Dict[int, Tuple[float, float]] = dict()
+        recorrido = 0.0
+        if len(ruta) == 1:
+            ruta = list(ruta) * 2
+        for (lat1, lon1), (lat2, lon2) in zip(ruta, ruta[1:]):
+            km_lon = KM_POR_GRADO * math.cos(math.radians((lat1 + lat2) / 2))
+            # tramo en coordenadas planas (km) con origen en su primer punto
+            dx, dy = (lon2 - lon1) * km_lon, (lat2 - lat1) * KM_POR_GRADO
+            largo2 = dx * dx + dy * dy
+            margen_lat, margen_lon = buffer / KM_POR_GRADO, buffer / km_lon
+            fmin, cmin = self._clave(min(lat1, lat2) - margen_lat, min(lon1, lon2) - margen_lon)
+            fmax, cmax = self._clave(max(lat1, lat2) + margen_lat, max(lon1, lon2) + margen_lon)
+            for f in range(fmin, fmax + 1):
+                for c in range(cmin, cmax + 1):
+                    for i in self._celdas.get((f, c), ()):
+                        px = (self.longitudes[i] - lon1) * km_lon
+                        py = (self.latitudes[i] - lat1) * KM_POR_GRADO
+                        t = min(1.0, max(0.0, (px * dx + py * dy) / largo2)) if largo2 else 0.0
+                        desvio = math.hypot(px - t * dx, py - t * dy)
+                        if desvio <= buffer and (i not in mejores or desvio < mejores[i][1]):
+                            mejores[i] = recorrido + t * math.sqrt(largo2), desvio
+            recorrido += math.sqrt(largo2)
+        return sorted(((i, km, desvio) for i, (km, desvio) in mejores.items()), key=lambda r: r[1])
@@ -0,0 +1,231 @@
+# -*- coding:utf-8 -*-
+import mmap
+import os
+import struct
+import time
+import zlib
+from array import array
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional as Opt, Tuple, Union as U
+
+from sopabarata.model import CCAA, Municipio, Provincia, Zona
+from sopabarata.tabla import TablaPrecios
+
+DIRECTORIO = os.environ.get('SOPABARATA_HISTORICO_DIR',
+                            str(Path('~', '.local', 'share', 'sopabarata', 'historico').expanduser()))
+
+# registro del indice: fecha, desplazamiento, filas, bytes de cada columna comprimida y marca de bloque completo
+_INDICE = struct.Struct('<dQIIIII')
+# registro de zonas: IDEESS, IDCCAA, IDProvincia, IDMunicipio
+_ZONA = struct.Struct('<IHHI')
+_COLUMNAS_ZONA = {CCAA: 1, Provincia: 2, Municipio: 3}
+
+NAN = float('nan')
+
+Cambio = Tuple[float, int, int, Opt[float]]
+
+
+def _marca(fecha: U[float, datetime, None]) -> float:
+    if fecha is None:
+        return time.time()
+    return fecha.timestamp() if isinstance(fecha, datetime) else float(fecha)
+
+
+class Historico:
+    """Historico de precios en disco, de solo anexado.
+
+    Cada refresco se guarda como un bloque con solo los precios que han cambiado respecto al anterior (un precio
+    NaN indica que la estacion ha dejado de vender el producto). Cada `completo_cada` bloques se guarda uno completo
+    para no tener que recorrer todo el historico al reconstruir precios.
+
+    Ficheros del directorio:
+
+    - bloques.dat: bloques con tres columnas comprimidas con zlib (IDEESS uint32, producto uint8, precio float32).
+    - indice.dat: un registro de tamaño fijo por bloque, ordenado por fecha; se consulta con mmap y busqueda
+      binaria, por lo que las consultas solo leen los bloques del intervalo pedido.
+    - zonas.dat: zonas (CCAA, provincia y municipio) de cada estacion registrada.
+    - ultimo.dat: ultimo estado completo, usado para calcular el siguiente bloque.
+
+    >>> import tempfile
+    >>> def tabla(*precios):
+    ...     return TablaPrecios([{'IDEESS': i, 'IDMunicipio': 1, 'Precio Gasoleo A': p}
+    ...                          for i, p in enumerate(precios, 1) if p is not None])
+    >>> historico = Historico(tempfile.mkdtemp(), completo_cada=2)
+    >>> [historico.registrar(tabla(*precios), fecha)
+    ...  for precios, fecha in [((1.5, 1.6), 1000), ((1.4, 1.6), 2000), ((1.4, None), 3000), ((1.3, None), 4000)]]
+    [2, 1, 2, 1]
+    >>> historico.serie(2500, 2500, producto=4)
+    [(2500.0, 1, 4, 1.4), (2500.0, 2, 4, 1.6)]
+    >>> historico.serie(3500, 4000, producto=4)
+    [(3500.0, 1, 4, 1.4), (4000.0, 1, 4, 1.3)]
+    >>> historico.serie(0, 4000, estacion=2)
+    [(1000.0, 2, 4, 1.6), (3000.0, 2, 4, None)]
+    """
+
+    def __init__(self, directorio: str = None, completo_cada: int = 48):
+        """Constructor.
+
+        :param directorio: carpeta del historico (SOPABARATA_HISTORICO_DIR o ~/.local/share/sopabarata/historico).
+        :param completo_cada: numero de bloques entre dos bloques completos.
+        """
+        self.directorio = Path(directorio or DIRECTORIO)
+        self.completo_cada = max(1, int(completo_cada))
+        self._zonas: Opt[Dict[int, Tuple[int, int, int, int]]] = None
+
+    def _ruta(self, nombre: str) -> Path:
+        return self.directorio / nombre
+
+    @staticmethod
+    def _comprimir(ids: array, productos: array, precios: array) -> Tuple[bytes, bytes, bytes]:
+        return tuple(zlib.compress(c.tobytes(), 6) for c in (ids, productos, precios))
+
+    @staticmethod
+    def _descomprimir(datos: bytes, longitudes: Tuple[int, int, int]) -> Tuple[array, array, array]:
+        columnas, inicio = list(), 0
+        for tipo, longitud in zip('IBf', longitudes):
+            columna = array(tipo)
+            columna.frombytes(zlib.decompress(datos[inicio:inicio + longitud]))
+            columnas.append(columna)
+            inicio += longitud
+        return tuple(columnas)
+
+    def _leer_ultimo(self) -> Dict[Tuple[int, int], float]:
+        try:
+            datos = self._ruta('ultimo.dat').read_bytes()
+        except OSError:
+            return dict()
+        longitudes = struct.unpack_from('<III', datos)
+        ids, productos, precios = self._descomprimir(datos[12:], longitudes)
+        return {(i, p): v for i, p, v in zip(ids, productos, precios)}
+
+    def _guardar_ultimo(self, estado: Dict[Tuple[int, int], float]):
+        columnas = array('I', (k[0] for k in estado)), array('B', (k[1] for k in estado)), array('f', estado.values())
+        comprimidas = self._comprimir(*columnas)
+        temporal = self._ruta(f'ultimo.{os.getpid()}.tmp')
+        temporal.write_bytes(struct.pack('<III', *map(len, comprimidas)) + b''.join(comprimidas))
+        os.replace(temporal, self._ruta('ultimo.dat'))
+
+    def _buscar(self, indice: mmap.mmap, fecha: float) -> int:
+        """Posicion del primer registro con fecha > `fecha` (busqueda binaria)."""
+        bajo, alto = 0, len(indice) // _INDICE.size
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            if _INDICE.unpack_from(indice, medio * _INDICE.size)[0] <= fecha:
+                bajo = medio + 1
+            else:
+                alto = medio
+        return bajo
+
+    def __len__(self):
+        ruta = self._ruta('indice.dat')
+        return ruta.stat().st_size // _INDICE.size if ruta.exists() else 0
+
+    def registrar(self, tabla: TablaPrecios, fecha: U[float, datetime] = None) -> int:
+        """Anexa un refresco al historico guardando solo los precios que han cambiado.
+
+        :param tabla: tabla de precios del refresco.
+        :param fecha: fecha del refresco (datetime o marca de tiempo), por defecto la actual.
+        :return: numero de precios guardados en el bloque.
+        """
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        fecha = _marca(fecha)
+        anterior = self._leer_ultimo()
+        estado = dict()
+        for producto, precios in tabla.precios.items():
+            for i, precio in enumerate(precios):
+                if precio == precio:
+                    estado[tabla.ids[i], producto] = precio
+
+        completo = len(self) % self.completo_cada == 0
+        if completo:
+            cambios = dict(estado)
+        else:
+            cambios = {k: v for k, v in estado.items() if anterior.get(k) != v}
+        cambios.update({k: NAN for k in anterior.keys() - estado.keys()})
+
+        self._registrar_zonas(tabla)
+        columnas = array('I', (k[0] for k in cambios)), array('B', (k[1] for k in cambios))
+        comprimidas = self._comprimir(*columnas, array('f', cambios.values()))
+        with open(self._ruta('bloques.dat'), 'ab') as bloques:
+            desplazamiento = bloques.seek(0, os.SEEK_END)
+            bloques.write(b''.join(comprimidas))
+        # el indice se escribe despues de los datos para que nunca apunte a un bloque incompleto
+        with open(self._ruta('indice.dat'), 'ab') as indice:
+            indice.write(_INDICE.pack(fecha, desplazamiento, len(cambios), *map(len, comprimidas), int(completo)))
+        self._guardar_ultimo(estado)
+        return len(cambios)
+
+    def _registrar_zonas(self, tabla: TablaPrecios):
+        zonas = self._leer_zonas()
+        nuevas = [(tabla.ids[i], tabla.ccaa[i], tabla.provincia[i], tabla.municipio[i])
+                  for i in range(len(tabla)) if tabla.ids[i] not in zonas]
+        if nuevas:
+            with open(self._ruta('zonas.dat'), 'ab') as fichero:
+                fichero.write(b''.join(_ZONA.pack(*z) for z in nuevas))
+            zonas.update((z[0], z) for z in nuevas)
+
+    def _leer_zonas(self) -> Dict[int, Tuple[int, int, int, int]]:
+        if self._zonas is None:
+            self._zonas = dict()
+            ruta = self._ruta('zonas.dat')
+            if ruta.exists():
+                self._zonas = {z[0]: z for z in _ZONA.iter_unpack(ruta.read_bytes())}
+        return self._zonas
+
+    def serie(self, desde: U[float, datetime], hasta: U[float, datetime], estacion: int = None,
+              zona: Zona = None, producto: int = None) -> List[Cambio]:
+        """Serie de precios entre dos fechas para una estacion, zona y/o producto.
+
+        La serie empieza con el precio vigente en `desde` (reconstruido desde el ultimo bloque completo anterior) y
+        continua con cada cambio registrado hasta `hasta`. Solo se descomprimen los bloques necesarios.
+
+        :param desde: fecha inicial (datetime o marca de tiempo).
+        :param hasta: fecha final, incluida.
+        :param estacion: IDEESS de la estacion.
+        :param zona: zona (CCAA, Provincia o Municipio) a la que deben pertenecer las estaciones.
+        :param producto: codigo de producto.
+        :return: lista de tuplas (fecha, IDEESS, producto, precio), precio None si deja de venderse.
+        """
+        desde, hasta = _marca(desde), _marca(hasta)
+        ruta_indice, ruta_bloques = self._ruta('indice.dat'), self._ruta('bloques.dat')
+        if len(self) == 0:
+            return list()
+
+        estaciones = None
+        if zona is not None:
+            columna, codigo = _COLUMNAS_ZONA[type(zona)], int(zona.codigo)
+            estaciones = {i for i, z in self._leer_zonas().items() if z[columna] == codigo}
+
+        def seleccionar(ids, productos, precios):
+            for i, p, v in zip(ids, productos, precios):
+                if (estacion is None or i == estacion) and (producto is None or p == producto) and \
+                        (estaciones is None or i in estaciones):
+                    yield i, p, v
+
+        with open(ruta_indice, 'rb') as fi, mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ) as indice, \
+                open(ruta_bloques, 'rb') as fb, mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ) as bloques:
+
+            def bloque(n):
+                registro = _INDICE.unpack_from(indice, n * _INDICE.size)
+                datos = bloques[registro[1]:registro[1] + sum(registro[3:6])]
+                return registro[0], self._descomprimir(datos, registro[3:6])
+
+            # estado en `desde`: ultimo bloque completo anterior mas los cambios posteriores hasta `desde`
+            primero = self._buscar(indice, desde)
+            inicio = primero - 1
+            while inicio > 0 and not _INDICE.unpack_from(indice, inicio * _INDICE.size)[6]:
+                inicio -= 1
+            estado = dict()
+            for n in range(max(inicio, 0), primero):
+                for i, p, v in seleccionar(*bloque(n)[1]):
+                    estado[i, p] = v
+            serie = [(desde, i, p, v) for (i, p), v in sorted(estado.items()) if v == v]
+
+            for n in range(primero, self._buscar(indice, hasta)):
+                fecha, columnas = bloque(n)
+                for i, p, v in seleccionar(*columnas):
+                    if estado.get((i, p)) != v:
+                        estado[i, p] = v
+                        serie.append((fecha, i, p, v if v == v else None))
+        return [(f, i, p, None if v is None else round(v, 3)) for f, i, p, v in serie]
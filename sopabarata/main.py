@@ -1,55 +1,302 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 import argparse
+import csv
+import json
+import sys
+from typing import Dict, Iterable, Iterator, List, TextIO, Tuple, Union as U
 
-from core import InfoCombustible
-from model import CCAA, Provincia
+from sopabarata import servidor
+from sopabarata.core import InfoCombustible, PRODUCTO
+from sopabarata.metricas import metricas
+from sopabarata.model import CCAA, Municipio, Producto, Provincia
+from sopabarata.utils import a_float
 
+# campo de zona de una consulta por lotes -> tipo de zona
+ZONAS = {'ccaa': CCAA, 'provincia': Provincia, 'municipio': Municipio}
 
-def main(args):
-    # print(vars(args))
-    # enmendar(args.provincia)
+
+def buscar_zona(nombre: str, tipo: type):
+    """Primera zona del tipo indicado cuyo nombre coincide con `nombre` (o None)."""
+    resultados = InfoCombustible.buscar_por_nombre(nombre)
+    for r in resultados if isinstance(resultados, list) else [resultados]:
+        if isinstance(r, tipo):
+            return r
+
+
+def resolver_producto(valor: str) -> int:
+    """Codigo de producto a partir de su codigo, abreviatura (ej: GOA) o parte de su nombre."""
+    if valor.isdigit():
+        return int(valor)
+    for p in InfoCombustible.get_productos():
+        if valor.strip().lower() == p.lower():
+            return int(p.codigo)
+    resultado = InfoCombustible.buscar_producto(valor)
+    if isinstance(resultado, Producto):
+        return int(resultado.codigo)
+    raise SystemExit(f'Producto no encontrado o ambiguo: "{valor}" (ver --carburantes)')
+
+
+def ranking(args, producto: int) -> Iterator[str]:
+    """Estaciones mas baratas para un producto en la zona indicada (o en todo el pais)."""
+    zona = None
+    for nombre, tipo in ((args.ccaa, CCAA), (args.provincia, Provincia), (args.municipio, Municipio)):
+        if nombre:
+            zona = buscar_zona(nombre, tipo)
+            if zona is None:
+                raise SystemExit(f'{tipo.__name__} no encontrada: "{nombre}"')
+    for est in InfoCombustible.get_ranking(producto, zona, args.top):
+        yield linea(est.precio(producto), est.rotulo, est.localidad)
+
+
+def linea(*valores) -> str:
+    """Valores separados por espacios, como los muestra `print`."""
+    return ' '.join(map(str, valores))
+
+
+def ejecutar(args) -> Iterator[str]:
+    """Resuelve una consulta de la linea de comandos.
+
+    :param args: opciones de la linea de comandos (`argparse.Namespace` o diccionario, las opciones que falten
+                 toman su valor por defecto).
+    :return: lineas de texto del resultado.
+    """
+    if isinstance(args, dict):
+        args = crear_parser().parse_args([], argparse.Namespace(**args))
+    producto = PRODUCTO if args.producto is None else resolver_producto(args.producto)
     if args.carburantes:
         for p in InfoCombustible.get_productos():
-            print(p.codigo, p.nombre, p.descripcion)
+            yield linea(p.codigo, p.nombre, p.descripcion)
+    elif getattr(args, 'buscar', None):
+        for c in InfoCombustible.autocompletar(args.buscar, args.top or 10):
+            yield linea(c.tipo, c.objeto.codigo, c.objeto.nombre, c.puntuacion)
+    elif (args.producto is not None or args.top is not None) and not args.cerca:
+        yield from ranking(args, producto)
     elif args.ccaa:
-        results = InfoCombustible.buscar_por_nombre(args.ccaa)
-        for r in results:
-            if isinstance(r, CCAA):
-                print(InfoCombustible.get_estaciones_por_ccaa(r))
-                break
+        r = buscar_zona(args.ccaa, CCAA)
+        if r is not None:
+            yield linea(InfoCombustible.get_estaciones_por_ccaa(r))
     elif args.provincia:
-        results = InfoCombustible.buscar_por_nombre(args.provincia)
-        for r in results:
-            if isinstance(r, Provincia):
-                for r in InfoCombustible.get_estaciones_por_provincia(r):
-                    print(r.precio_gasolina_95, r.rotulo, r.localidad)
-                break
+        r = buscar_zona(args.provincia, Provincia)
+        if r is not None:
+            for est in InfoCombustible.get_estaciones_por_provincia(r):
+                yield linea(est.precio(producto) or -1.0, est.rotulo, est.localidad)
+    elif args.cerca:
+        lat, lon = args.cerca
+        if args.radio:
+            resultados = InfoCombustible.get_mas_baratas_en_radio(lat, lon, args.radio, producto, args.top or 10)
+        else:
+            resultados = InfoCombustible.get_cercanas(lat, lon, args.top or 10)
+        for est, km in resultados:
+            yield linea(est.precio(producto), est.rotulo, est.localidad, f'{km:.1f} km')
     elif args.municipio:
         results = InfoCombustible.buscar_por_nombre(args.municipio)
         if type(results).__name__ == 'Municipio':
             for est in InfoCombustible.get_estaciones_por_municipio(results):
-                print(est.precio_gasolina_95, est.rotulo, est.localidad)
+                yield linea(est.precio(producto) or -1.0, est.rotulo, est.localidad)
         elif isinstance(results, list):
             for r in results:
                 if type(r).__name__ == 'Municipio':
-                    print(InfoCombustible.get_estaciones_por_municipio(r))
+                    yield linea(InfoCombustible.get_estaciones_por_municipio(r))
 
 
-def run():
-    # import sys
-    # sys.argv.extend(['-m', 'Puerto Del Rosario'])
+def leer_lote(entrada: TextIO) -> Iterator[U[Dict, str]]:
+    """Consultas de un lote en formato JSON lines o CSV con cabecera (se detecta por el primer caracter).
+
+    Campos: ccaa, provincia o municipio (nombre o codigo), producto, top, cerca ("lat,lon"), lat, lon y radio.
+
+    :param entrada: fichero de texto con una consulta por linea.
+    :return: consultas CSV como diccionarios y consultas JSON como texto sin decodificar (ver `decodificar_consulta`),
+             para que una linea mal formada no detenga la lectura del resto.
+    """
+    lineas = (texto for texto in entrada if texto.strip())
+    primera = next(lineas, None)
+    if primera is None:
+        return
+    if primera.lstrip().startswith('{'):
+        for texto in _encadenar(primera, lineas):
+            yield texto.strip()
+    else:
+        for fila in csv.DictReader(_encadenar(primera, lineas)):
+            yield {k.strip().lower(): v.strip() for k, v in fila.items() if k and v not in (None, '')}
+
+
+def decodificar_consulta(consulta: U[Dict, str]) -> Dict:
+    """Consulta de un lote como diccionario.
+
+    :param consulta: consulta devuelta por `leer_lote`.
+    :return: campos de la consulta.
+    :raise ValueError: si la linea no es un objeto JSON.
+    """
+    if isinstance(consulta, str):
+        consulta = json.loads(consulta)
+    if not isinstance(consulta, dict):
+        raise ValueError(f'La consulta debe ser un objeto JSON, no {type(consulta).__name__}')
+    return consulta
+
+
+def _encadenar(primera: str, resto: Iterable[str]) -> Iterator[str]:
+    yield primera
+    yield from resto
+
+
+def _clave_consulta(consulta: Dict) -> Tuple:
+    """Resuelve nombres y valores de una consulta en una clave que identifica la peticion subyacente."""
+    producto = consulta.get('producto')
+    producto = PRODUCTO if producto in (None, '') else resolver_producto(str(producto))
+    top = consulta.get('top')
+    top = None if top in (None, '') else int(top)
+    cerca = consulta.get('cerca')
+    if isinstance(cerca, str):
+        cerca = coordenadas(cerca)
+    elif cerca is None and consulta.get('lat') not in (None, '') and consulta.get('lon') not in (None, ''):
+        cerca = float(consulta['lat']), float(consulta['lon'])
+    if cerca is not None:
+        radio = consulta.get('radio')
+        radio = None if radio in (None, '') else float(radio)
+        return 'cerca', tuple(map(float, cerca)), radio, producto, top or 10
+    for campo, tipo in ZONAS.items():
+        valor = consulta.get(campo)
+        if valor in (None, ''):
+            continue
+        zona = InfoCombustible.get_zona(tipo, int(valor)) if str(valor).isdigit() else buscar_zona(valor, tipo)
+        if zona is None:
+            raise SystemExit(f'{tipo.__name__} no encontrada: "{valor}"')
+        # sin producto ni top se listan todas las estaciones de la zona, como en la consulta individual
+        ranking = consulta.get('producto') not in (None, '') or top is not None
+        return campo, int(zona.codigo), ranking, producto, top
+    if consulta.get('producto') not in (None, '') or top is not None:
+        return 'pais', 0, True, producto, top
+    raise SystemExit('Consulta sin zona, producto ni coordenadas')
+
+
+def _estacion_dict(est, producto: int, km: float = None) -> Dict:
+    datos = dict(codigo=int(est.codigo), rotulo=est.rotulo, direccion=est.direccion, localidad=est.localidad,
+                 latitud=a_float(est.latitud), longitud=a_float(est.longitud), precio=est.precio(producto))
+    if km is not None:
+        datos['km'] = round(km, 2)
+    return datos
+
+
+def _resolver(clave: Tuple) -> List[Dict]:
+    if clave[0] == 'cerca':
+        (lat, lon), radio, producto, top = clave[1:]
+        if radio:
+            resultados = InfoCombustible.get_mas_baratas_en_radio(lat, lon, radio, producto, top)
+        else:
+            resultados = InfoCombustible.get_cercanas(lat, lon, top)
+        return [_estacion_dict(est, producto, km) for est, km in resultados]
+    nivel, codigo, ranking, producto, top = clave
+    zona = None if nivel == 'pais' else InfoCombustible.get_zona(ZONAS[nivel], codigo)
+    if ranking:
+        estaciones = InfoCombustible.get_ranking(producto, zona, top)
+    else:
+        estaciones = getattr(InfoCombustible, f'get_estaciones_por_{nivel}')(zona)
+    return [_estacion_dict(est, producto) for est in estaciones]
+
+
+def ejecutar_lote(entrada: TextIO, salida: TextIO):
+    """Resuelve un lote de consultas sobre un unico conjunto de datos cargado (la instantanea nacional).
+
+    Las consultas que se resuelven en la misma peticion (misma zona, producto y numero de estaciones aunque se
+    escriban de distinta forma) se calculan una sola vez. Cada resultado se escribe en cuanto esta disponible
+    como una linea JSON con la consulta original y sus estaciones o el error. Una consulta erronea no detiene el
+    lote:
+
+    >>> import io
+    >>> ejecutar_lote(io.StringIO('{"cerca": "a,b"}\\nno es json\\n[1, 2]\\n'), sys.stdout)
+    {"consulta": {"cerca": "a,b"}, "error": "Coordenadas no validas: \\"a,b\\" (formato: lat,lon)"}
+    {"consulta": "no es json", "error": "Expecting value: line 1 column 1 (char 0)"}
+    {"consulta": "[1, 2]", "error": "La consulta debe ser un objeto JSON, no list"}
+
+    :param entrada: consultas en formato JSON lines o CSV.
+    :param salida: fichero de salida de las lineas JSON.
+    """
+    InfoCombustible.modo_snapshot = True
+    resueltas: Dict[Tuple, List[Dict]] = dict()
+    for n, consulta in enumerate(leer_lote(entrada), 1):
+        try:
+            consulta = decodificar_consulta(consulta)
+            clave = _clave_consulta(consulta)
+            if clave not in resueltas:
+                resueltas[clave] = _resolver(clave)
+            resultado = dict(consulta=consulta, estaciones=resueltas[clave])
+        except (SystemExit, Exception) as err:
+            # un error en una consulta (linea mal formada, zona inexistente, fallo de red...) no detiene el lote
+            resultado = dict(consulta=consulta, error=str(err) or f'Consulta no valida en la linea {n}')
+        salida.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+        salida.flush()
+
+
+def main(args):
+    # print(vars(args))
+    # enmendar(args.provincia)
+    if args.servidor:
+        return servidor.servir(ejecutar, puerto=args.puerto, detallado=True)
+    try:
+        if args.lote == '-':
+            ejecutar_lote(sys.stdin, sys.stdout)
+        elif args.lote:
+            with open(args.lote, encoding='utf-8') as entrada:
+                ejecutar_lote(entrada, sys.stdout)
+        else:
+            opciones = {k: v for k, v in vars(args).items()
+                        if k not in ('servidor', 'directo', 'puerto', 'lote', 'stats')}
+            # con el servidor local en marcha la consulta se resuelve sobre sus datos en memoria (salvo con --stats,
+            # que mide las etapas de este proceso)
+            directo = args.directo or args.stats
+            lineas = None if directo else servidor.consultar(opciones, puerto=args.puerto)
+            for texto in ejecutar(opciones) if lineas is None else lineas:
+                print(texto)
+    finally:
+        if args.stats:
+            print(metricas.json(), file=sys.stderr)
+
+
+def coordenadas(texto: str):
+    """Convierte "lat,lon" en una tupla de floats (argumento --cerca)."""
+    try:
+        lat, lon = (float(v) for v in texto.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Coordenadas no validas: "{texto}" (formato: lat,lon)')
+    return lat, lon
+
+
+def crear_parser() -> argparse.ArgumentParser:
+    """Opciones de la linea de comandos."""
     parser = argparse.ArgumentParser()
     parser.add_argument('-C', '--carburantes', action='store_true', help='Listado de carburantes (Productos)')
+    parser.add_argument('-b', '--buscar', metavar='TEXTO',
+                        help='Municipios, provincias, comunidades y productos cuyo nombre empieza por o se parece a '
+                             'TEXTO (admite erratas).')
     zona = parser.add_mutually_exclusive_group()
     zona.add_argument('-c', '--ccaa', help='Filtro por Comunidad Autónoma.')
     zona.add_argument('-p', '--provincia', help='Filtro por Provincia.')
     zona.add_argument('-m', '--municipio', help='Filtro por Municipio.')
+    zona.add_argument('--cerca', type=coordenadas, metavar='LAT,LON', help='Estaciones cercanas a unas coordenadas.')
+    parser.add_argument('--radio', type=float, metavar='KM',
+                        help='Con --cerca, las estaciones mas baratas a menos de KM kilometros.')
+    parser.add_argument('--producto', metavar='PRODUCTO',
+                        help='Codigo, abreviatura (ej: GOA) o nombre del producto (por defecto Gasolina 95 E5).')
+    parser.add_argument('--top', type=int, metavar='N', help='Solo las N estaciones mas baratas.')
+    parser.add_argument('--servidor', action='store_true',
+                        help='Arranca el servidor local que mantiene los datos en memoria para las demas consultas.')
+    parser.add_argument('--puerto', type=int, help=f'Puerto del servidor local (por defecto {servidor.PUERTO}).')
+    parser.add_argument('--directo', action='store_true', help='No usa el servidor local aunque este en marcha.')
+    parser.add_argument('--stats', action='store_true',
+                        help='Muestra en stderr las metricas de la consulta (bytes, tiempos por etapa, objetos, '
+                             'cache y busquedas) en JSON.')
+    parser.add_argument('--lote', metavar='FICHERO',
+                        help='Resuelve las consultas de un fichero JSON lines o CSV ("-" para stdin) y escribe los '
+                             'resultados como JSON lines.')
+    return parser
+
 
-    main(parser.parse_args())
+def run():
+    # import sys
+    # sys.argv.extend(['-m', 'Puerto Del Rosario'])
+    main(crear_parser().parse_args())
 
 
 if __name__ == '__main__':
     run()
-sa
-sa
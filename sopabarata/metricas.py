@@ -0,0 +1,169 @@
+# -*- coding:utf-8 -*-
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# funcion suscrita a las metricas: recibe tipo ("contador" o "tiempo"), nombre, valor y etiquetas
+Suscriptor = Callable[[str, str, float, Dict[str, str]], None]
+
+_Clave = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _clave(nombre: str, etiquetas: Dict[str, object]) -> _Clave:
+    # valores como texto: una misma etiqueta puede recibir enteros y textos (ej: estado=200 y estado="Timeout") y
+    # las claves deben poder ordenarse al exportar
+    return nombre, tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas_prometheus(etiquetas: Tuple[Tuple[str, str], ...]) -> str:
+    if not etiquetas:
+        return ''
+    valores = (f'{k}="{_escapar(v)}"' for k, v in etiquetas)
+    return '{' + ','.join(valores) + '}'
+
+
+class Metricas:
+    """Contadores y tiempos de las etapas de consulta (descarga, decodificacion, construccion de modelos,
+    busquedas, cache).
+
+    Los contadores acumulan valores (peticiones, bytes, objetos construidos...) y los tiempos acumulan numero de
+    mediciones, suma y maximo en segundos. Ambos admiten etiquetas. Las funciones registradas con `suscribir`
+    reciben cada medicion en el momento, para reenviarlas a otro sistema (statsd, logs...).
+    """
+
+    def __init__(self, prefijo: str = 'sopabarata'):
+        """Constructor.
+
+        :param prefijo: prefijo de los nombres exportados en formato Prometheus.
+        """
+        self.prefijo = prefijo
+        # desactivadas, `contar` y `medir` no registran nada
+        self.activas = True
+        self._contadores: Dict[_Clave, float] = dict()
+        self._tiempos: Dict[_Clave, List[float]] = dict()
+        self._suscriptores: List[Suscriptor] = list()
+        self._bloqueo = threading.Lock()
+
+    def contar(self, nombre: str, valor: float = 1, **etiquetas):
+        """Suma `valor` a un contador.
+
+        :param nombre: nombre del contador (ej: "http_bytes").
+        :param valor: cantidad a sumar.
+        :param etiquetas: etiquetas del contador (ej: modelo="EESS").
+        """
+        if not self.activas:
+            return
+        clave = _clave(nombre, etiquetas)
+        with self._bloqueo:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+        for suscriptor in self._suscriptores:
+            suscriptor('contador', nombre, valor, etiquetas)
+
+    def observar(self, nombre: str, segundos: float, **etiquetas):
+        """Registra la duracion de una etapa.
+
+        :param nombre: nombre del tiempo (ej: "etapa").
+        :param segundos: duracion en segundos.
+        :param etiquetas: etiquetas del tiempo (ej: etapa="http").
+        """
+        if not self.activas:
+            return
+        clave = _clave(nombre, etiquetas)
+        with self._bloqueo:
+            medida = self._tiempos.setdefault(clave, [0, 0.0, 0.0])
+            medida[0] += 1
+            medida[1] += segundos
+            medida[2] = max(medida[2], segundos)
+        for suscriptor in self._suscriptores:
+            suscriptor('tiempo', nombre, segundos, etiquetas)
+
+    @contextmanager
+    def medir(self, nombre: str, **etiquetas) -> Iterator[None]:
+        """Mide la duracion del bloque `with` (tambien si termina con una excepcion).
+
+        :param nombre: nombre del tiempo.
+        :param etiquetas: etiquetas del tiempo.
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nombre, time.perf_counter() - inicio, **etiquetas)
+
+    def suscribir(self, funcion: Suscriptor):
+        """Registra una funcion que recibira cada medicion (tipo, nombre, valor, etiquetas).
+
+        :param funcion: funcion suscrita.
+        """
+        self._suscriptores.append(funcion)
+
+    def reiniciar(self):
+        """Pone a cero todos los contadores y tiempos."""
+        with self._bloqueo:
+            self._contadores.clear()
+            self._tiempos.clear()
+
+    def valor(self, nombre: str, **etiquetas) -> float:
+        """Valor actual de un contador.
+
+        :param nombre: nombre del contador.
+        :param etiquetas: etiquetas del contador.
+        :return: valor acumulado (0 si no se ha contado nada).
+        """
+        return self._contadores.get(_clave(nombre, etiquetas), 0)
+
+    def como_dict(self) -> Dict:
+        """Contadores y tiempos en un diccionario serializable a JSON.
+
+        :return: diccionario con las claves "contadores" y "tiempos".
+        """
+        with self._bloqueo:
+            contadores = [dict(nombre=n, etiquetas=dict(e), valor=v)
+                          for (n, e), v in self._contadores.items()]
+            tiempos = [dict(nombre=n, etiquetas=dict(e), mediciones=m[0], segundos=round(m[1], 6),
+                            maximo=round(m[2], 6)) for (n, e), m in self._tiempos.items()]
+        return dict(contadores=contadores, tiempos=tiempos)
+
+    def json(self) -> str:
+        """Contadores y tiempos en JSON (ver `como_dict`)."""
+        return json.dumps(self.como_dict(), indent=2, ensure_ascii=False)
+
+    def prometheus(self) -> str:
+        """Contadores y tiempos en el formato de texto de Prometheus.
+
+        Los contadores se exportan como `<prefijo>_<nombre>_total` y los tiempos como resumen
+        (`<prefijo>_<nombre>_segundos_count` y `_sum`) mas el maximo observado (`_segundos_max`).
+
+        :return: texto de exposicion de Prometheus.
+        """
+        with self._bloqueo:
+            contadores, tiempos = dict(self._contadores), {k: list(v) for k, v in self._tiempos.items()}
+        lineas = list()
+        for nombre in sorted({n for n, _ in contadores}):
+            lineas.append(f'# TYPE {self.prefijo}_{nombre}_total counter')
+            for (n, etiquetas), valor in sorted(contadores.items()):
+                if n == nombre:
+                    valor = int(valor) if float(valor).is_integer() else valor
+                    lineas.append(f'{self.prefijo}_{nombre}_total{_etiquetas_prometheus(etiquetas)} {valor}')
+        for nombre in sorted({n for n, _ in tiempos}):
+            base = f'{self.prefijo}_{nombre}_segundos'
+            lineas.append(f'# TYPE {base} summary')
+            for (n, etiquetas), (cuenta, suma, _) in sorted(tiempos.items()):
+                if n == nombre:
+                    texto = _etiquetas_prometheus(etiquetas)
+                    lineas += [f'{base}_count{texto} {cuenta}', f'{base}_sum{texto} {suma:.6f}']
+            lineas.append(f'# TYPE {base}_max gauge')
+            for (n, etiquetas), (_, _, maximo) in sorted(tiempos.items()):
+                if n == nombre:
+                    lineas.append(f'{base}_max{_etiquetas_prometheus(etiquetas)} {maximo:.6f}')
+        return '\n'.join(lineas) + '\n'
+
+
+# metricas del proceso, compartidas por el cliente HTTP, InfoCombustible y la cache
+metricas = Metricas()
@@ -0,0 +1,189 @@
+# -*- coding:utf-8 -*-
+import http.client
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional as Opt
+from urllib.parse import parse_qs, urlsplit
+
+from sopabarata.core import InfoCombustible
+from sopabarata.metricas import metricas
+
+HOST = os.environ.get('SOPABARATA_HOST', '127.0.0.1')
+PUERTO = int(os.environ.get('SOPABARATA_PUERTO', 8765))
+
+# funcion que resuelve una consulta de la linea de comandos (opciones de argparse) en lineas de texto
+Ejecutor = Callable[[Dict], Iterable[str]]
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    server: 'Servidor'
+
+    def _responder(self, estado: int, datos: Dict):
+        self._enviar(estado, json.dumps(datos, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+    def _enviar(self, estado: int, cuerpo: bytes, tipo: str):
+        self.send_response(estado)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/estado':
+            self._responder(200, self.server.estado())
+        elif self.path.rstrip('/') == '/metrics':
+            self._enviar(200, metricas.prometheus().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+        elif self.path.rstrip('/') == '/metricas':
+            self._responder(200, metricas.como_dict())
+        elif urlsplit(self.path).path.rstrip('/') == '/sugerencias':
+            parametros = parse_qs(urlsplit(self.path).query)
+            try:
+                n = int(parametros.get('n', ['10'])[0])
+            except ValueError:
+                return self._responder(400, dict(error='n debe ser un numero'))
+            self._responder(200, dict(sugerencias=self.server.sugerencias(parametros.get('q', [''])[0], n)))
+        else:
+            self._responder(404, dict(error=f'Ruta no encontrada: {self.path}'))
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/consulta':
+            return self._responder(404, dict(error=f'Ruta no encontrada: {self.path}'))
+        try:
+            opciones = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            if not isinstance(opciones, dict):
+                raise TypeError('se esperaba un objeto JSON con las opciones')
+            self._responder(200, dict(lineas=self.server.consultar(opciones)))
+        except SystemExit as err:
+            self._responder(400, dict(error=str(err)))
+        except (ValueError, TypeError) as err:
+            self._responder(400, dict(error=f'Consulta no valida: {err}'))
+        except Exception as err:
+            self._responder(500, dict(error=f'Error al resolver la consulta: {err}'))
+
+    def log_message(self, formato, *args):
+        if self.server.detallado:
+            super().log_message(formato, *args)
+
+
+class Servidor(ThreadingHTTPServer):
+    """Servidor local que mantiene en memoria los datos de referencia, la instantanea nacional y sus indices.
+
+    Las consultas se resuelven en modo instantanea, por lo que no se descarga ni decodifica nada por consulta; la
+    instantanea se refresca en segundo plano cada `InfoCombustible.intervalo_snapshot` segundos (o cada
+    `InfoCombustible.reintento_snapshot` tras un fallo) y las consultas solo esperan mientras se aplica, no
+    mientras se descarga. Escucha solo en la interfaz local.
+
+    API JSON:
+
+    - GET /estado: numero de estaciones, fecha de la instantanea y consultas atendidas.
+    - GET /metrics: metricas del proceso en formato Prometheus (GET /metricas en JSON).
+    - GET /sugerencias?q=texto&n=10: zonas y productos cuyo nombre empieza por o se parece al texto.
+    - POST /consulta: opciones de la linea de comandos, responde {"lineas": [...]} o {"error": "..."}.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, ejecutar: Ejecutor, host: str = None, puerto: int = None, detallado: bool = False):
+        """Constructor.
+
+        :param ejecutar: funcion que resuelve las opciones de una consulta en lineas de texto.
+        :param host: interfaz de escucha (SOPABARATA_HOST o 127.0.0.1).
+        :param puerto: puerto de escucha (SOPABARATA_PUERTO o 8765).
+        :param detallado: registra cada peticion en stderr.
+        """
+        super().__init__((host or HOST, PUERTO if puerto is None else int(puerto)), _Manejador)
+        self.ejecutar = ejecutar
+        self.detallado = detallado
+        self.consultas = 0
+        # aplicar un refresco modifica la instantanea, las consultas no pueden ejecutarse a la vez
+        self._bloqueo = threading.Lock()
+        self._parar = threading.Event()
+
+    def precargar(self):
+        """Descarga los datos de referencia y la instantanea y construye los indices."""
+        InfoCombustible.modo_snapshot = True
+        InfoCombustible.refresco_en_segundo_plano = True
+        with self._bloqueo:
+            InfoCombustible.get_productos()
+            InfoCombustible.get_municipios()
+            InfoCombustible.get_indice_difuso()
+            tabla = InfoCombustible.get_tabla_precios()
+            tabla.espacial
+            tabla.precalcular_rankings()
+
+    def _refrescar(self):
+        espera = InfoCombustible.intervalo_snapshot
+        while not self._parar.wait(espera):
+            datos = InfoCombustible.descargar_snapshot()
+            if datos:
+                with self._bloqueo:
+                    InfoCombustible.aplicar_snapshot(datos).tabla.precalcular_rankings()
+            espera = InfoCombustible.intervalo_snapshot if datos else InfoCombustible.reintento_snapshot
+
+    def estado(self) -> Dict:
+        snapshot = InfoCombustible._snapshot
+        return dict(estaciones=0 if snapshot is None else len(snapshot),
+                    fecha=None if snapshot is None else snapshot.fecha, consultas=self.consultas)
+
+    def sugerencias(self, texto: str, n: int = 10) -> List[Dict]:
+        with self._bloqueo:
+            coincidencias = InfoCombustible.autocompletar(texto, n)
+        return [dict(nombre=c.objeto.nombre, tipo=c.tipo, codigo=int(c.objeto.codigo), puntuacion=c.puntuacion)
+                for c in coincidencias]
+
+    def consultar(self, opciones: Dict) -> List[str]:
+        with self._bloqueo, metricas.medir('etapa', etapa='servidor'):
+            self.consultas += 1
+            return list(self.ejecutar(opciones))
+
+    def serve_forever(self, poll_interval: float = 0.5):
+        threading.Thread(target=self._refrescar, name='sopabarata-refresco', daemon=True).start()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._parar.set()
+
+
+def servir(ejecutar: Ejecutor, host: str = None, puerto: int = None, detallado: bool = False):
+    """Arranca el servidor local en primer plano, con los datos ya cargados.
+
+    :param ejecutar: funcion que resuelve las opciones de una consulta en lineas de texto.
+    :param host: interfaz de escucha.
+    :param puerto: puerto de escucha.
+    :param detallado: registra cada peticion en stderr.
+    """
+    with Servidor(ejecutar, host, puerto, detallado) as servidor:
+        servidor.precargar()
+        print(f'sopabarata: servidor en http://{servidor.server_address[0]}:{servidor.server_address[1]}',
+              file=sys.stderr)
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def consultar(opciones: Dict, host: str = None, puerto: int = None, timeout: float = 30) -> Opt[List[str]]:
+    """Envia una consulta al servidor local.
+
+    :param opciones: opciones de la linea de comandos (serializables a JSON).
+    :param host: interfaz del servidor.
+    :param puerto: puerto del servidor.
+    :param timeout: segundos de espera de la respuesta.
+    :return: lineas de la respuesta o None si el servidor no esta en marcha.
+    :raise SystemExit: si el servidor rechaza la consulta (ej: zona no encontrada).
+    """
+    conexion = http.client.HTTPConnection(host or HOST, PUERTO if puerto is None else int(puerto), timeout=timeout)
+    try:
+        conexion.request('POST', '/consulta', json.dumps(opciones), {'Content-Type': 'application/json'})
+        respuesta = conexion.getresponse()
+        datos = json.loads(respuesta.read())
+    except (OSError, http.client.HTTPException, ValueError):
+        return None
+    finally:
+        conexion.close()
+    if 'error' in datos:
+        raise SystemExit(datos['error'])
+    return datos.get('lineas')
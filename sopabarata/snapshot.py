@@ -0,0 +1,208 @@
+# -*- coding:utf-8 -*-
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional as Opt
+
+import sopabarata.static as st
+from sopabarata.metricas import metricas
+from sopabarata.tabla import TablaPrecios
+
+ZONAS = 'IDCCAA', 'IDProvincia', 'IDMunicipio'
+
+
+class Cambios(NamedTuple):
+    """Cambios de una actualizacion incremental, como listas de IDEESS."""
+
+    anadidas: List[int]
+    eliminadas: List[int]
+    repreciadas: List[int]
+    # estaciones con cambios en otros campos (horario, rotulo, ...) pero no en sus precios
+    actualizadas: List[int]
+
+    def total(self) -> int:
+        return len(self.anadidas) + len(self.eliminadas) + len(self.repreciadas) + len(self.actualizadas)
+
+
+class Snapshot:
+    """Instantanea en memoria del listado nacional de estaciones (EstacionesTerrestres).
+
+    Las consultas por zona y producto se resuelven localmente mediante indices construidos una sola vez, que
+    `actualizar` mantiene al dia fila a fila. Las filas de estaciones eliminadas quedan vacias (None) para no
+    alterar la posicion del resto.
+    """
+
+    def __init__(self, datos: Dict):
+        """Constructor.
+
+        :param datos: respuesta del servicio EstacionesTerrestres (ya decodificada).
+        """
+        self.creado = time.time()
+        self.fecha = datos.get('Fecha')
+        self.filas: List[Opt[Dict]] = list()
+        self._posicion: Dict[int, int] = dict()
+        # codigo de zona -> filas (diccionario usado como conjunto ordenado)
+        self._por_zona = {zona: dict() for zona in ZONAS}
+        self._por_producto = {codigo: set() for codigo in st.CAMPOS_PRECIO}
+        self._objetos: Dict[int, Any] = dict()
+        self._tabla = None
+
+        for fila in datos.get('ListaEESSPrecio') or list():
+            self._anadir(fila)
+
+    def __len__(self):
+        return len(self._posicion)
+
+    def _anadir(self, fila: Dict) -> int:
+        i = len(self.filas)
+        self.filas.append(fila)
+        self._posicion[fila.get('IDEESS')] = i
+        self._indexar(i, fila)
+        return i
+
+    def _indexar(self, i: int, fila: Dict):
+        for zona, indice in self._por_zona.items():
+            indice.setdefault(fila.get(zona), dict())[i] = None
+        for codigo, campo in st.CAMPOS_PRECIO.items():
+            if fila.get(campo) not in (None, ''):
+                self._por_producto[codigo].add(i)
+
+    def _desindexar(self, i: int, fila: Dict):
+        for zona, indice in self._por_zona.items():
+            indice.get(fila.get(zona), dict()).pop(i, None)
+        for con_producto in self._por_producto.values():
+            con_producto.discard(i)
+
+    @property
+    def tabla(self) -> TablaPrecios:
+        """Tabla columnar de precios de la instantanea, construida en el primer acceso."""
+        if self._tabla is None:
+            self._tabla = TablaPrecios(self.filas)
+        return self._tabla
+
+    def caducado(self, intervalo: float) -> bool:
+        """Comprueba si la instantanea es mas antigua que el intervalo de refresco.
+
+        :param intervalo: segundos de validez de la instantanea.
+        :return: True si debe descargarse de nuevo.
+        """
+        return time.time() - self.creado >= intervalo
+
+    def fila(self, ideess: int) -> Opt[Dict]:
+        """Datos en bruto de una estacion.
+
+        :param ideess: identificador de la estacion.
+        :return: la estacion o None si no esta en la instantanea.
+        """
+        i = self._posicion.get(ideess)
+        return None if i is None else self.filas[i]
+
+    def indices(self, zona: str = None, codigo: int = None, producto: int = None) -> List[int]:
+        """Filas de las estaciones de una zona y/o producto.
+
+        :param zona: campo de zona ("IDCCAA", "IDProvincia" o "IDMunicipio").
+        :param codigo: codigo de la zona.
+        :param producto: codigo del producto.
+        :return: indices de fila.
+        """
+        if zona is None:
+            indices = self._posicion.values()
+        else:
+            indices = self._por_zona[zona].get(codigo, dict())
+        if producto is not None:
+            con_producto = self._por_producto.get(producto, set())
+            return [i for i in indices if i in con_producto]
+        return list(indices)
+
+    def objeto(self, i: int, construir: Callable[[Dict], Any]) -> Any:
+        """Objeto construido a partir de una fila, reutilizado mientras la fila no cambie.
+
+        :param i: indice de fila.
+        :param construir: funcion que construye el objeto a partir de los datos en bruto (ej: `EESS(**fila)`).
+        :return: el objeto de la fila.
+        """
+        if i not in self._objetos:
+            metricas.contar('objetos_instantanea', resultado='construido')
+            self._objetos[i] = construir(self.filas[i])
+        else:
+            metricas.contar('objetos_instantanea', resultado='reutilizado')
+        return self._objetos[i]
+
+    def filtrar(self, zona: str = None, codigo: int = None, producto: int = None) -> Dict:
+        """Filtra las estaciones por zona y/o producto.
+
+        El resultado tiene el mismo formato que las respuestas de los servicios REST de filtrado, incluido el
+        campo "PrecioProducto" cuando se filtra por producto.
+
+        :param zona: campo de zona ("IDCCAA", "IDProvincia" o "IDMunicipio").
+        :param codigo: codigo de la zona.
+        :param producto: codigo del producto.
+        :return: diccionario con las claves "Fecha" y "ListaEESSPrecio".
+        """
+        indices = self.indices(zona, codigo, producto)
+        if producto is None:
+            filas = [self.filas[i] for i in indices]
+        else:
+            campo = st.CAMPOS_PRECIO.get(producto)
+            filas = [dict(self.filas[i], PrecioProducto=self.filas[i][campo]) for i in indices]
+
+        return dict(Fecha=self.fecha, ListaEESSPrecio=filas)
+
+    def actualizar(self, datos: Dict) -> Cambios:
+        """Actualiza la instantanea con un nuevo listado comparando estacion a estacion (por IDEESS).
+
+        Solo se modifican las filas, indices, objetos y columnas de la tabla de las estaciones que han cambiado.
+
+        >>> def fila(ideess, municipio, precio):
+        ...     return {'IDEESS': ideess, 'IDCCAA': 1, 'IDProvincia': 1, 'IDMunicipio': municipio,
+        ...             'Precio Gasolina 95 E5': precio}
+        >>> snapshot = Snapshot({'ListaEESSPrecio': [fila(1, 10, 1.5), fila(2, 10, 1.4), fila(3, 20, 1.6)]})
+        >>> tabla = snapshot.tabla
+        >>> [tabla.ids[i] for i in tabla.top(1)], [tabla.ids[i] for i in tabla.top(1, municipio=10)]
+        ([2, 1, 3], [2, 1])
+        >>> snapshot.actualizar({'ListaEESSPrecio': [fila(1, 10, 1.3), fila(3, 20, 1.6), fila(4, 20, 1.45)]})
+        Cambios(anadidas=[4], eliminadas=[2], repreciadas=[1], actualizadas=[])
+        >>> snapshot.filas[1] is None, len(snapshot), len(tabla)
+        (True, 3, 4)
+        >>> [tabla.ids[i] for i in tabla.top(1)], [tabla.ids[i] for i in tabla.top(1, municipio=20)]
+        ([1, 4, 3], [4, 3])
+        >>> snapshot.indices('IDMunicipio', 10), snapshot.indices(producto=1)
+        ([0], [0, 2, 3])
+
+        :param datos: nueva respuesta del servicio EstacionesTerrestres (ya decodificada).
+        :return: estaciones añadidas, eliminadas, con precios nuevos y con otros cambios.
+        """
+        cambios = Cambios(list(), list(), list(), list())
+        vistas = set()
+        for nueva in datos.get('ListaEESSPrecio') or list():
+            ideess = nueva.get('IDEESS')
+            vistas.add(ideess)
+            i = self._posicion.get(ideess)
+            if i is None:
+                i = self._anadir(nueva)
+                cambios.anadidas.append(ideess)
+            else:
+                vieja = self.filas[i]
+                if nueva == vieja:
+                    continue
+                if any(nueva.get(c) != vieja.get(c) for c in st.CAMPOS_PRECIO.values()):
+                    cambios.repreciadas.append(ideess)
+                else:
+                    cambios.actualizadas.append(ideess)
+                self._desindexar(i, vieja)
+                self.filas[i] = nueva
+                self._indexar(i, nueva)
+                self._objetos.pop(i, None)
+            if self._tabla is not None:
+                self._tabla.actualizar(i, nueva)
+
+        for ideess in [e for e in self._posicion if e not in vistas]:
+            i = self._posicion.pop(ideess)
+            self._desindexar(i, self.filas[i])
+            self.filas[i] = None
+            self._objetos.pop(i, None)
+            if self._tabla is not None:
+                self._tabla.eliminar(i)
+            cambios.eliminadas.append(ideess)
+
+        self.creado = time.time()
+        self.fecha = datos.get('Fecha', self.fecha)
+        return cambios
@@ -4,3 +4,21 @@ BASE_URL = 'https://sedeaplicaciones.minetur.gob.es/ServiciosRESTCarburantes/Pre
 
 REST_ESTACION = f'{BASE_URL}/EstacionesTerrestres/Filtro'
 REST_LISTADO = f'{BASE_URL}/Listados'
+REST_ESTACIONES = f'{BASE_URL}/EstacionesTerrestres/'
+
+# codigo de producto (Listados/ProductosPetroliferos) -> campo de precio en EstacionesTerrestres
+CAMPOS_PRECIO = {
+    1: 'Precio Gasolina 95 E5',
+    3: 'Precio Gasolina 98 E5',
+    4: 'Precio Gasoleo A',
+    5: 'Precio Gasoleo Premium',
+    6: 'Precio Gasoleo B',
+    8: 'Precio Biodiesel',
+    16: 'Precio Bioetanol',
+    17: 'Precio Gas Natural Comprimido',
+    18: 'Precio Gas Natural Licuado',
+    19: 'Precio Gases licuados del petróleo',
+    20: 'Precio Gasolina 95 E5 Premium',
+    21: 'Precio Gasolina 98 E10',
+    23: 'Precio Gasolina 95 E10',
+}
@@ -0,0 +1,311 @@
+# -*- coding:utf-8 -*-
+import heapq
+import math
+from array import array
+from itertools import compress
+from typing import Dict, Iterable, List, Optional as Opt, Tuple, Union as U
+
+import sopabarata.static as st
+from sopabarata.estadisticas import Estadisticas, Jerarquia
+from sopabarata.geo import IndiceEspacial
+from sopabarata.model import EESS, Estacion
+from sopabarata.utils import a_float
+
+NAN = float('nan')
+# columnas de zona por las que se precalculan rankings
+NIVELES = 'ccaa', 'provincia', 'municipio'
+
+
+class TablaPrecios:
+    """Representacion columnar de un listado de estaciones.
+
+    Los precios se guardan en columnas float32 (una por producto, NaN si la estacion no lo vende) y los codigos de
+    zona en columnas de enteros. Los filtros, ordenaciones y minimos trabajan con indices de fila y solo se
+    construyen objetos `EESS` para las filas devueltas.
+
+    >>> def fila(ideess, ccaa, provincia, municipio, precio):
+    ...     return {'IDEESS': ideess, 'IDCCAA': ccaa, 'IDProvincia': provincia, 'IDMunicipio': municipio,
+    ...             'Precio Gasoleo A': precio}
+    >>> tabla = TablaPrecios([fila(1, 1, 1, 10, 1.5), fila(2, 1, 1, 10, None), None, fila(4, 1, 2, 20, 1.4),
+    ...                       fila(5, 2, 3, 30, 1.3), fila(6, 1, 1, 11, 1.45)])
+    >>> tabla.filtrar(provincia=1), tabla.filtrar(provincia=1, producto=4)
+    ([0, 1, 5], [0, 5])
+    >>> tabla.ordenar([0, 1, 5], 4), tabla.ordenar([0, 1, 5], 4, descendente=True)
+    ([5, 0, 1], [0, 5, 1])
+    >>> tabla.minimo(4), tabla.minimo(4, [0, 1, 5]), tabla.minimo(4, [1, 2])
+    ((4, 1.3), (5, 1.45), None)
+    >>> tabla.top(4), tabla.top(4, 2), tabla.top(4, ccaa=1), tabla.top(4, municipio=99)
+    ([4, 3, 5, 0], [4, 3], [3, 5, 0], [])
+    >>> tabla.ranking_zona(4, 'provincia', 1), tabla.precio(5, 4), tabla.precio(1, 4)
+    ([5, 0], 1.45, None)
+    """
+
+    def __init__(self, filas: List[Opt[Dict]]):
+        """Constructor.
+
+        :param filas: estaciones en bruto ("ListaEESSPrecio"), las filas None se tratan como huecos.
+        """
+        self.filas = filas
+        filas = [f or dict() for f in filas]
+        self.ids = array('l', (int(f.get('IDEESS') or 0) for f in filas))
+        self.ccaa = array('h', (int(f.get('IDCCAA') or 0) for f in filas))
+        self.provincia = array('h', (int(f.get('IDProvincia') or 0) for f in filas))
+        self.municipio = array('l', (int(f.get('IDMunicipio') or 0) for f in filas))
+        self.latitud = array('d', (a_float(f.get('Latitud'), NAN) for f in filas))
+        self.longitud = array('d', (a_float(f.get('Longitud (WGS84)'), NAN) for f in filas))
+        self.precios = {codigo: array('f', (a_float(f.get(campo), NAN) for f in filas))
+                        for codigo, campo in st.CAMPOS_PRECIO.items()}
+        self._rankings = dict()
+        self._estadisticas = None
+        self._espacial = None
+        self._huecos = self.ids.count(0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def actualizar(self, indice: int, fila: Dict):
+        """Actualiza (o añade si `indice` es el numero de filas) las columnas de una fila.
+
+        Se descartan los rankings y estadisticas calculados y, si cambian las coordenadas, el indice espacial.
+
+        :param indice: indice de fila.
+        :param fila: nuevos datos en bruto de la estacion.
+        """
+        valores = [(self.ids, int(fila.get('IDEESS') or 0)), (self.ccaa, int(fila.get('IDCCAA') or 0)),
+                   (self.provincia, int(fila.get('IDProvincia') or 0)),
+                   (self.municipio, int(fila.get('IDMunicipio') or 0)),
+                   (self.latitud, a_float(fila.get('Latitud'), NAN)),
+                   (self.longitud, a_float(fila.get('Longitud (WGS84)'), NAN))]
+        valores += [(self.precios[codigo], a_float(fila.get(campo), NAN)) for codigo, campo in st.CAMPOS_PRECIO.items()]
+        if indice == len(self):
+            for columna, valor in valores:
+                columna.append(valor)
+            self._espacial = None
+        else:
+            if self.ids[indice] == 0:
+                self._huecos -= 1
+            if (self.latitud[indice], self.longitud[indice]) != (valores[4][1], valores[5][1]):
+                self._espacial = None
+            for columna, valor in valores:
+                columna[indice] = valor
+        self._huecos += valores[0][1] == 0
+        self._rankings.clear()
+        self._estadisticas = None
+
+    def eliminar(self, indice: int):
+        """Vacia una fila (estacion eliminada) sin alterar la posicion del resto.
+
+        :param indice: indice de fila.
+        """
+        if self.ids[indice] != 0:
+            self._huecos += 1
+        for columna in (self.ids, self.ccaa, self.provincia, self.municipio):
+            columna[indice] = 0
+        for columna in (self.latitud, self.longitud, *self.precios.values()):
+            columna[indice] = NAN
+        self._espacial = None
+        self._rankings.clear()
+        self._estadisticas = None
+
+    def _columna(self, producto: int) -> array:
+        if producto not in self.precios:
+            # productos sin campo de precio en el listado (ej: Hidrogeno): ninguna estacion tiene precio, igual que
+            # responde el servicio REST de filtrado
+            return array('f', [NAN]) * len(self)
+        return self.precios[producto]
+
+    def filtrar(self, ccaa: int = None, provincia: int = None, municipio: int = None,
+                producto: int = None) -> List[int]:
+        """Indices de las filas que cumplen todos los filtros indicados.
+
+        :param ccaa: codigo de comunidad autonoma.
+        :param provincia: codigo de provincia.
+        :param municipio: codigo de municipio.
+        :param producto: codigo de producto, solo se devuelven estaciones con precio para el.
+        :return: indices de fila.
+        """
+        indices = range(len(self)) if self._huecos == 0 else list(compress(range(len(self)), self.ids))
+        for columna, codigo in ((self.ccaa, ccaa), (self.provincia, provincia), (self.municipio, municipio)):
+            if codigo is not None:
+                valores = columna if isinstance(indices, range) else map(columna.__getitem__, indices)
+                indices = list(compress(indices, map(int(codigo).__eq__, valores)))
+        if producto is not None:
+            precios = self._columna(producto)
+            # NaN != NaN, descarta las estaciones sin precio
+            indices = list(compress(indices, (p == p for p in map(precios.__getitem__, indices))))
+        return list(indices)
+
+    def ordenar(self, indices: Iterable[int], producto: int, descendente: bool = False) -> List[int]:
+        """Ordena filas por el precio de un producto, las filas sin precio quedan al final.
+
+        :param indices: indices de fila a ordenar.
+        :param producto: codigo de producto.
+        :param descendente: ordena de mayor a menor precio.
+        :return: indices ordenados.
+        """
+        precios, indices = self._columna(producto), list(indices)
+        con_precio = [i for i in indices if precios[i] == precios[i]]
+        sin_precio = [i for i in indices if precios[i] != precios[i]]
+        return sorted(con_precio, key=precios.__getitem__, reverse=descendente) + sin_precio
+
+    def minimo(self, producto: int, indices: Iterable[int] = None) -> Opt[Tuple[int, float]]:
+        """Fila con el precio minimo de un producto (argmin).
+
+        :param producto: codigo de producto.
+        :param indices: filas candidatas, todas si no se indica.
+        :return: tupla (indice, precio) o None si ninguna fila tiene precio.
+        """
+        precios = self._columna(producto)
+        if indices is None:
+            indices = self.filtrar(producto=producto)
+        else:
+            indices = [i for i in indices if precios[i] == precios[i]]
+        if not indices:
+            return None
+        i = min(indices, key=precios.__getitem__)
+        return i, self.precio(i, producto)
+
+    def ranking(self, producto: int) -> List[int]:
+        """Filas con precio para el producto ordenadas de menor a mayor precio.
+
+        El ranking se calcula una sola vez por tabla.
+
+        :param producto: codigo de producto.
+        :return: indices de fila ordenados por precio.
+        """
+        if producto not in self._rankings:
+            self._rankings[producto] = sorted(self.filtrar(producto=producto), key=self._columna(producto).__getitem__)
+        return self._rankings[producto]
+
+    def ranking_zona(self, producto: int, nivel: str, codigo: int) -> List[int]:
+        """Ranking de un producto dentro de una zona.
+
+        La primera consulta de cada producto y nivel reparte el ranking nacional entre los codigos de zona, por lo
+        que las siguientes consultas de cualquier zona de ese nivel no ordenan nada.
+
+        :param producto: codigo de producto.
+        :param nivel: columna de zona ("ccaa", "provincia" o "municipio").
+        :param codigo: codigo de la zona.
+        :return: indices de fila de la zona ordenados por precio.
+        """
+        if nivel not in NIVELES:
+            raise ValueError(f'Nivel de zona no valido: {nivel}')
+        if (producto, nivel) not in self._rankings:
+            columna, por_zona = getattr(self, nivel), dict()
+            for i in self.ranking(producto):
+                por_zona.setdefault(columna[i], list()).append(i)
+            self._rankings[producto, nivel] = por_zona
+        return self._rankings[producto, nivel].get(int(codigo), list())
+
+    def top(self, producto: int, n: int = None, ccaa: int = None, provincia: int = None,
+            municipio: int = None) -> List[int]:
+        """Las `n` filas mas baratas de un producto, en todo el pais o en una zona, a partir de los rankings.
+
+        :param producto: codigo de producto.
+        :param n: numero de filas, todas si no se indica.
+        :param ccaa: codigo de comunidad autonoma.
+        :param provincia: codigo de provincia.
+        :param municipio: codigo de municipio (tiene prioridad sobre provincia y esta sobre ccaa).
+        :return: indices de fila ordenados por precio.
+        """
+        for nivel, codigo in (('municipio', municipio), ('provincia', provincia), ('ccaa', ccaa)):
+            if codigo is not None:
+                ranking = self.ranking_zona(producto, nivel, codigo)
+                break
+        else:
+            ranking = self.ranking(producto)
+        return ranking[:n] if n is not None else list(ranking)
+
+    def precalcular_rankings(self, productos: Iterable[int] = None):
+        """Calcula de antemano los rankings nacionales y por zona (tras cada refresco se descartan).
+
+        :param productos: codigos de producto, todos si no se indican.
+        """
+        for producto in self.precios if productos is None else productos:
+            for nivel in NIVELES:
+                self.ranking_zona(producto, nivel, 0)
+
+    def mas_baratas(self, indices: Iterable[int], producto: int, n: int = 10) -> List[int]:
+        """Las `n` filas mas baratas de un conjunto arbitrario, con seleccion parcial (heap) en lugar de ordenar.
+
+        :param indices: filas candidatas.
+        :param producto: codigo de producto.
+        :param n: numero de filas.
+        :return: indices de fila ordenados por precio, sin las filas sin precio.
+        """
+        precios = self._columna(producto)
+        return heapq.nsmallest(n, (i for i in indices if precios[i] == precios[i]), key=precios.__getitem__)
+
+    def posiciones(self, producto: int) -> Dict[int, int]:
+        """Posicion (1 = la mas barata) de cada estacion en el ranking nacional de un producto.
+
+        :param producto: codigo de producto.
+        :return: diccionario IDEESS -> posicion.
+        """
+        return {self.ids[i]: n for n, i in enumerate(self.ranking(producto), 1)}
+
+    def estadisticas(self, jerarquia: Jerarquia = None) -> Estadisticas:
+        """Estadisticas de precio por producto y zona, calculadas en el primer acceso tras cada cambio de la tabla.
+
+        :param jerarquia: codigo de municipio -> (codigo de provincia, codigo de CCAA), solo se usa al calcularlas.
+        :return: estadisticas de la tabla.
+        """
+        if self._estadisticas is None:
+            self._estadisticas = Estadisticas(self, jerarquia)
+        return self._estadisticas
+
+    def precio(self, indice: int, producto: int) -> Opt[float]:
+        """Precio de un producto en una fila.
+
+        :param indice: indice de fila.
+        :param producto: codigo de producto.
+        :return: precio redondeado a milesimas o None si la estacion no vende el producto.
+        """
+        valor = self._columna(producto)[indice]
+        return None if math.isnan(valor) else round(valor, 3)
+
+    @property
+    def espacial(self) -> IndiceEspacial:
+        """Indice espacial sobre las coordenadas de las filas, construido en el primer acceso."""
+        if self._espacial is None:
+            self._espacial = IndiceEspacial(self.latitud, self.longitud)
+        return self._espacial
+
+    def mas_baratas_en_radio(self, lat: float, lon: float, radio: float, producto: int,
+                             n: int = 10) -> List[Tuple[int, float]]:
+        """Las `n` filas mas baratas para un producto a menos de `radio` km de un punto.
+
+        :param lat: latitud del centro.
+        :param lon: longitud del centro.
+        :param radio: radio en km.
+        :param producto: codigo de producto.
+        :param n: numero de filas.
+        :return: lista de tuplas (indice, distancia en km) ordenada por precio y distancia.
+        """
+        precios = self._columna(producto)
+        candidatas = [(i, d) for i, d in self.espacial.en_radio(lat, lon, radio) if precios[i] == precios[i]]
+        return heapq.nsmallest(n, candidatas, key=lambda r: (precios[r[0]], r[1]))
+
+    def mas_baratas_en_ruta(self, ruta: List[Tuple[float, float]], buffer: float, producto: int,
+                            n: int = 10) -> List[Tuple[int, float, float]]:
+        """Las `n` filas mas baratas para un producto a menos de `buffer` km de una ruta.
+
+        :param ruta: lista de puntos (lat, lon) en orden de recorrido.
+        :param buffer: distancia maxima a la ruta en km.
+        :param producto: codigo de producto.
+        :param n: numero de filas.
+        :return: lista de tuplas (indice, km recorridos, desvio en km) ordenada por precio y km recorridos.
+        """
+        precios = self._columna(producto)
+        candidatas = [r for r in self.espacial.en_corredor(ruta, buffer) if precios[r[0]] == precios[r[0]]]
+        return heapq.nsmallest(n, candidatas, key=lambda r: (precios[r[0]], r[1]))
+
+    def estaciones(self, indices: Iterable[int], modelo: type = EESS) -> List[U[EESS, Estacion]]:
+        """Construye objetos de estacion solo para las filas indicadas.
+
+        :param indices: indices de fila.
+        :param modelo: clase usada para las estaciones (`EESS` o `Estacion`).
+        :return: estaciones en el mismo orden que los indices.
+        """
+        return [modelo(**self.filas[i]) for i in indices]
+
@@ -1,5 +1,14 @@
 # -*- coding:utf-8 -*-
+import codecs
+import json
 import re
+from typing import Any, Dict, Iterable, Iterator, Union as U
+
+# campos numericos conocidos de los servicios EstacionesTerrestres y Listados
+CAMPOS_ENTEROS = frozenset({'IDEESS', 'IDMunicipio', 'IDProvincia', 'IDCCAA', 'IDProducto'})
+CAMPOS_DECIMALES = frozenset({'Latitud', 'Longitud (WGS84)', 'PrecioProducto', '% BioEtanol', '% Éster metílico'})
+_DECIMAL = re.compile(r'-?\d+(?:,\d*)?')
+_SEPARADORES = re.compile(r'[\s,]*')
 
 
 def normalizar(text: str) -> str:
@@ -40,6 +49,127 @@ def to_num(obj):
             return obj
 
 
+def a_float(valor, defecto: float = None) -> float:
+    """Convierte un numero con coma decimal (formato del ministerio) a float.
+
+    >>> a_float('1,459')
+    1.459
+    >>> a_float('') is None
+    True
+
+    :param valor: numero como texto con coma o punto decimal, o numero.
+    :param defecto: valor devuelto si no hay numero.
+    :return: el numero como float o el valor por defecto.
+    """
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    if isinstance(valor, str) and len(valor):
+        return float(valor.replace(',', '.'))
+    return defecto
+
+
+def _decodificar_objeto(obj: Dict) -> Dict:
+    for k, v in obj.items():
+        if not isinstance(v, str):
+            continue
+        if k in CAMPOS_ENTEROS:
+            if v.isdigit():
+                obj[k] = int(v)
+        elif k in CAMPOS_DECIMALES or k.startswith('Precio '):
+            if not v:
+                obj[k] = None
+            elif _DECIMAL.fullmatch(v):
+                obj[k] = float(v.replace(',', '.'))
+    return obj
+
+
+def decodificar(datos: U[bytes, str, Dict, list]) -> Any:
+    """Decodifica una respuesta del ministerio convirtiendo solo los campos numericos conocidos.
+
+    Los identificadores (IDEESS, IDMunicipio, ...) pasan a int y precios, coordenadas y porcentajes (coma decimal) a
+    float, None si estan vacios. El resto de campos no se modifica. Con bytes o texto la conversion se hace durante
+    el propio analisis del JSON.
+
+    >>> decodificar(b'[{"IDProvincia": "02", "Precio Gasoleo A": "1,459", "Precio Gasoleo B": "", "C.P.": "02001"}]')
+    [{'IDProvincia': 2, 'Precio Gasoleo A': 1.459, 'Precio Gasoleo B': None, 'C.P.': '02001'}]
+
+    :param datos: JSON en bruto (bytes o texto) o ya analizado.
+    :return: datos decodificados.
+    """
+    if isinstance(datos, bytes):
+        if datos.startswith(codecs.BOM_UTF8):
+            datos = datos[len(codecs.BOM_UTF8):]
+        return json.loads(datos, object_hook=_decodificar_objeto)
+    elif isinstance(datos, str):
+        return json.loads(datos.lstrip('\ufeff'), object_hook=_decodificar_objeto)
+    elif isinstance(datos, dict):
+        return _decodificar_objeto({k: decodificar(v) if isinstance(v, (dict, list)) else v for k, v in datos.items()})
+    elif isinstance(datos, list):
+        return [decodificar(v) if isinstance(v, (dict, list)) else v for v in datos]
+    return datos
+
+
+def iterar_lista(fragmentos: Iterable[bytes], clave: str = 'ListaEESSPrecio') -> Iterator[Dict]:
+    """Analiza de forma incremental la lista `clave` de un JSON recibido por fragmentos.
+
+    Cada elemento de la lista se decodifica (ver `decodificar`) y se devuelve en cuanto esta completo, de modo que
+    nunca se mantiene en memoria el documento entero.
+
+    >>> list(iterar_lista([b'{"Fecha": "1", "ListaEESSPrecio": [{"IDEESS": "1"', b'}, {"IDEESS": "2"}]}']))
+    [{'IDEESS': 1}, {'IDEESS': 2}]
+
+    Un documento cortado (aunque sea justo tras un elemento completo) o sin la lista es un error:
+
+    >>> list(iterar_lista([b'{"ListaEESSPrecio": [{"IDEESS": "1"}, ']))
+    Traceback (most recent call last):
+    ...
+    ValueError: Lista "ListaEESSPrecio" incompleta o mal formada.
+    >>> list(iterar_lista([b'{"ResultadoConsulta": "ERROR"}']))
+    Traceback (most recent call last):
+    ...
+    ValueError: Lista "ListaEESSPrecio" no encontrada en la respuesta.
+
+    :param fragmentos: bytes del JSON en el orden recibido (ej: `respuesta.iter_content()`).
+    :param clave: nombre de la lista a recorrer.
+    :return: generador de elementos de la lista.
+    :raise ValueError: si la respuesta termina antes del cierre de la lista o no la contiene.
+    """
+    decoder = json.JSONDecoder(object_hook=_decodificar_objeto)
+    texto = codecs.getincrementaldecoder('utf-8-sig')()
+    marca = f'"{clave}"'
+    buffer, pos, dentro = '', 0, False
+
+    for fragmento in fragmentos:
+        buffer = buffer[pos:] + texto.decode(fragmento)
+        pos = 0
+        if not dentro:
+            inicio = buffer.find(marca)
+            corchete = buffer.find('[', inicio + len(marca)) if inicio >= 0 else -1
+            if corchete < 0:
+                # conserva lo suficiente para encontrar la marca partida entre dos fragmentos
+                pos = max(0, inicio if inicio >= 0 else len(buffer) - len(marca))
+                continue
+            pos, dentro = corchete + 1, True
+
+        while True:
+            pos = _SEPARADORES.match(buffer, pos).end()
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == ']':
+                return
+            try:
+                elemento, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # elemento incompleto, se espera al siguiente fragmento
+                break
+            yield elemento
+
+    # la lista termina con su corchete de cierre (return anterior), agotar los fragmentos antes es un corte
+    if not dentro:
+        raise ValueError(f'Lista "{clave}" no encontrada en la respuesta.')
+    raise ValueError(f'Lista "{clave}" incompleta o mal formada.')
+
+
 def camel2snake(text):  # , class_name=None):
     """Convert text from camel case (helloWorld) to snake case (hello_world).
 